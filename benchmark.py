@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Reproducible benchmarks for scanning, decoding and navigation
+
+Generates a synthetic image tree in a temporary directory and prints the
+results as JSON. Pass --compare with an earlier result to flag regressions.
+
+    python benchmark.py --files 20000 --output bench.json
+    python benchmark.py --compare bench.json
+"""
+
+import argparse
+import json
+import os
+import os.path
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from util import History, PathTable, get_files
+
+ORIENTATION = 0x0112
+
+
+def parse_resolution(s):
+    width, height = s.lower().split("x")
+    return int(width), int(height)
+
+
+def make_tree(root, files, depth, fanout, formats, rng):
+    """Create files empty images spread over a tree of the given depth"""
+    dirs = [root]
+    level = [root]
+    for d in range(depth):
+        level = [os.path.join(parent, "dir{}_{}".format(d, i))
+                 for parent in level for i in range(fanout)]
+        dirs += level
+    for d in dirs:
+        os.makedirs(d, exist_ok=True)
+
+    paths = list()
+    for i in range(files):
+        ext = rng.choice(formats)
+        path = os.path.join(rng.choice(dirs), "IMG_{:06d}.{}".format(i, ext))
+        open(path, "wb").close()
+        paths.append(path)
+    return paths
+
+
+def make_images(root, count, formats, resolutions, orientations, rng):
+    """Create real images with noise content and EXIF orientations"""
+    from PIL import Image
+
+    os.makedirs(root, exist_ok=True)
+    paths = list()
+    for i in range(count):
+        width, height = rng.choice(resolutions)
+        ext = rng.choice(formats)
+        image = Image.merge("RGB", [Image.effect_noise((width, height), 48)
+                                    for _ in range(3)])
+        path = os.path.join(root, "IMG_{:06d}.{}".format(i, ext))
+        if ext in ("jpg", "jpeg"):
+            exif = Image.Exif()
+            exif[ORIENTATION] = rng.choice(orientations)
+            image.save(path, "JPEG", quality=90, exif=exif)
+        else:
+            image.save(path)
+        paths.append(path)
+    return paths
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        "n": len(samples),
+        "mean": statistics.mean(samples),
+        "p50": samples[len(samples) // 2],
+        "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        "max": samples[-1],
+    }
+
+
+def timed(fn, repeat):
+    samples = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples), result
+
+
+def bench_scan(root, extensions, args):
+    results = dict()
+    for workers in (1, args.workers):
+        stats, files = timed(lambda: get_files(root, extensions,
+                                               workers=workers), args.repeat)
+        stats["files_per_s"] = len(files) / stats["p50"]
+        results["scandir_workers_{}".format(workers)] = stats
+
+    index_path = os.path.join(args.tmp, "index.db")
+    stats, files = timed(lambda: get_files(root, extensions, index_path,
+                                           args.workers), 1)
+    stats["files_per_s"] = len(files) / stats["p50"]
+    results["index_cold"] = stats
+    stats, files = timed(lambda: get_files(root, extensions, index_path,
+                                           args.workers), args.repeat)
+    stats["files_per_s"] = len(files) / stats["p50"]
+    results["index_warm"] = stats
+    return results
+
+
+def bench_memory(paths):
+    tracemalloc.start()
+    strings = [os.path.normpath(p).encode().decode() for p in paths]
+    list_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del strings
+
+    tracemalloc.start()
+    table = PathTable()
+    for p in paths:
+        table.add(os.path.normpath(p))
+    table_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return {
+        "list_bytes_per_path": list_bytes / len(paths),
+        "table_bytes_per_path": table_bytes / len(paths),
+    }
+
+
+def bench_decode(paths, args):
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5.QtWidgets import QApplication
+    from PyQt5.QtGui import QPixmap
+    from loader import load_image
+    from stats import stats
+
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    from qtslide import toQImage
+    width, height = args.screen
+    allocations = stats.snapshot()["counters"].get("frame_allocations", 0)
+
+    load, convert = list(), list()
+    for path in paths:
+        start = time.perf_counter()
+        image = load_image(path, width, height)
+        middle = time.perf_counter()
+        QPixmap.fromImage(toQImage(image))
+        end = time.perf_counter()
+        load.append(middle - start)
+        convert.append(end - middle)
+    del app
+    allocations = stats.snapshot()["counters"].get(
+        "frame_allocations", 0) - allocations
+
+    return {
+        "load": summarize(load),
+        "to_pixmap": summarize(convert),
+        "total": summarize([a + b for a, b in zip(load, convert)]),
+        # fromImage is not counted outside of the Slideshow
+        "frame_allocations_per_image": allocations / len(paths) + 1,
+    }
+
+
+def bench_history(args):
+    history = History(maxlen=args.history)
+    start = time.perf_counter()
+    for i in range(args.history * 16):
+        history.push(i)
+    push = (time.perf_counter() - start) / (args.history * 16)
+
+    start = time.perf_counter()
+    while history.hasPrev():
+        history.prev()
+    while history.hasNext():
+        history.next()
+    navigate = (time.perf_counter() - start) / (2 * history.size())
+    return {"push_s": push, "navigate_s": navigate}
+
+
+def compare(current, baseline, threshold, prefix=""):
+    """Yield (key, baseline, current) of timings and sizes that grew"""
+    for key, value in current.items():
+        old = baseline.get(key)
+        name = prefix + key
+        if isinstance(value, dict) and isinstance(old, dict):
+            yield from compare(value, old, threshold, name + ".")
+        elif (key in ("p50", "mean") or key.endswith(("_s", "_per_path"))) \
+                and isinstance(old, (int, float)):
+            if old > 0 and value > old * (1 + threshold):
+                yield name, old, value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--files", type=int, default=20000)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--fanout", type=int, default=6)
+    parser.add_argument("--formats", default="jpg,png")
+    parser.add_argument("--images", type=int, default=20,
+                        help="number of real images to decode")
+    parser.add_argument("--resolutions", default="6000x4000,4000x3000",
+                        type=lambda s: [parse_resolution(r)
+                                        for r in s.split(",")])
+    parser.add_argument("--orientations", default="1,3,6,8",
+                        type=lambda s: [int(o) for o in s.split(",")])
+    parser.add_argument("--screen", default="1920x1080",
+                        type=parse_resolution)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--history", type=int, default=256)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip", default="",
+                        help="comma separated benchmarks to skip "
+                             "(scan, memory, decode, history)")
+    parser.add_argument("--output", help="write results to this file")
+    parser.add_argument("--compare", help="earlier results to compare to")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="allowed slowdown before failing")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    formats = args.formats.split(",")
+    extensions = ["." + f for f in formats]
+    skip = args.skip.split(",")
+
+    args.tmp = tempfile.mkdtemp(prefix="bildschirm-bench-")
+    results = {
+        "params": {k: v for k, v in vars(args).items()
+                   if k not in ("output", "compare", "tmp")},
+        "platform": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "system": platform.system(),
+        },
+    }
+    try:
+        root = os.path.join(args.tmp, "tree")
+        paths = make_tree(root, args.files, args.depth, args.fanout,
+                          formats, rng)
+        if "scan" not in skip:
+            results["scan"] = bench_scan(root, extensions, args)
+        if "memory" not in skip:
+            results["memory"] = bench_memory(paths)
+        if "decode" not in skip:
+            images = make_images(os.path.join(args.tmp, "images"),
+                                 args.images, formats, args.resolutions,
+                                 args.orientations, rng)
+            results["decode"] = bench_decode(images, args)
+        if "history" not in skip:
+            results["history"] = bench_history(args)
+    finally:
+        shutil.rmtree(args.tmp, ignore_errors=True)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = list(compare(results, baseline, args.threshold))
+        for name, old, new in regressions:
+            print("REGRESSION {}: {:.6f} -> {:.6f}".format(name, old, new),
+                  file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,13 @@
+import copy
+import os.path
+
 
 class MetaConfig:
     def _configure(self, d: dict, name: str):
         setattr(self, name, d.get(name, getattr(self, name)))
 
     def _make_config(self, d: dict, name: str, config_class):
-        setattr(self, name, config_class(d.get(name)))
+        setattr(self, name, config_class(d.get(name, dict())))
 
 
 class ScreenConfig(MetaConfig):
@@ -14,10 +17,36 @@ class ScreenConfig(MetaConfig):
     gui = "Qt"
     width = 1920
     height = 1080
+    index_path = "bildschirm.db"
+    library_path = "bildschirm.library"
+    scan_workers = 8
+    watch = True
+    watch_interval = 300
+    source_cache_path = "sources"
+    source_cache_size = 1024 * 1024 * 1024
+    source_connections = 4
+    quarantine_path = "bildschirm.quarantine"
+    # check images in the background before they are shown
+    verify = True
+    verify_delay = 1.0
+    # index of the monitor a window is placed on
+    screen = None
 
     def __init__(self, d=dict()):
         self._configure(d, "hide_cursor")
         self._configure(d, "image_path")
+        self._configure(d, "index_path")
+        self._configure(d, "library_path")
+        self._configure(d, "scan_workers")
+        self._configure(d, "watch")
+        self._configure(d, "watch_interval")
+        self._configure(d, "source_cache_path")
+        self._configure(d, "source_cache_size")
+        self._configure(d, "source_connections")
+        self._configure(d, "quarantine_path")
+        self._configure(d, "verify")
+        self._configure(d, "verify_delay")
+        self._configure(d, "screen")
         self._configure(d, "gui")
         self._configure(d, "width")
         self._configure(d, "height")
@@ -29,6 +58,17 @@ class SlideshowConfig(MetaConfig):
     history_length = 256
     fullscreen = True
     topmost = True
+    prefetch = 2
+    decode_workers = 2
+    pixmap_cache_size = 64 * 1024 * 1024
+    shuffle = "permutation"
+    session_path = "bildschirm.session"
+    max_image_pixels = 64 * 1000 * 1000
+    max_image_bytes = 256 * 1024 * 1024
+    # "cut" or "crossfade"
+    transition = "cut"
+    transition_duration = 1.0
+    transition_fps = 30
 
     def __init__(self, d=dict()):
         self._configure(d, "interval")
@@ -36,9 +76,87 @@ class SlideshowConfig(MetaConfig):
         self._configure(d, "history_length")
         self._configure(d, "fullscreen")
         self._configure(d, "topmost")
+        self._configure(d, "prefetch")
+        self._configure(d, "decode_workers")
+        self._configure(d, "pixmap_cache_size")
+        self._configure(d, "shuffle")
+        self._configure(d, "session_path")
+        self._configure(d, "max_image_pixels")
+        self._configure(d, "max_image_bytes")
+        self._configure(d, "transition")
+        self._configure(d, "transition_duration")
+        self._configure(d, "transition_fps")
+
+
+class CacheConfig(MetaConfig):
+    render_path = "renders"
+    render_size = 512 * 1024 * 1024
+    render_quality = 90
+
+    def __init__(self, d=dict()):
+        self._configure(d, "render_path")
+        self._configure(d, "render_size")
+        self._configure(d, "render_quality")
+
+
+class PrerenderConfig(MetaConfig):
+    path = "prerendered"
+    quality = 90
+    workers = 0
+
+    def __init__(self, d=dict()):
+        self._configure(d, "path")
+        self._configure(d, "quality")
+        self._configure(d, "workers")
+
+
+class StatsConfig(MetaConfig):
+    host = "127.0.0.1"
+    port = 0
+    log_interval = 300
+
+    def __init__(self, d=dict()):
+        self._configure(d, "host")
+        self._configure(d, "port")
+        self._configure(d, "log_interval")
 
 
 class Config(MetaConfig):
+    # settings a window in [[screens]] can override
+    WINDOW_SCREEN = ("width", "height", "screen")
+    WINDOW_SLIDESHOW = ("interval", "fullscreen", "prefetch",
+                        "pixmap_cache_size", "session_path", "transition",
+                        "transition_duration", "transition_fps")
+
     def __init__(self, d=dict()):
+        self._screens = d.get("screens", list())
         self._make_config(d, "screen", ScreenConfig)
         self._make_config(d, "slideshow", SlideshowConfig)
+        self._make_config(d, "cache", CacheConfig)
+        self._make_config(d, "prerender", PrerenderConfig)
+        self._make_config(d, "stats", StatsConfig)
+
+    def windows(self):
+        """
+        Return a Config for every window listed in [[screens]]
+
+        Each one is a copy of this Config with the overrides of its window.
+        Without [[screens]] there is just one window with this Config.
+        """
+        if not self._screens:
+            return [self]
+
+        configs = list()
+        for i, d in enumerate(self._screens):
+            config = copy.copy(self)
+            config.screen = copy.copy(self.screen)
+            config.slideshow = copy.copy(self.slideshow)
+            if i and config.slideshow.session_path:
+                base, ext = os.path.splitext(config.slideshow.session_path)
+                config.slideshow.session_path = "{}.{}{}".format(base, i, ext)
+            for name in self.WINDOW_SCREEN:
+                config.screen._configure(d, name)
+            for name in self.WINDOW_SLIDESHOW:
+                config.slideshow._configure(d, name)
+            configs.append(config)
+        return configs
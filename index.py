@@ -0,0 +1,201 @@
+import os
+import os.path
+import sqlite3
+
+from logger import create_logger
+from util import ScanError, contains, walk
+logger = create_logger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    dir TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+"""
+
+
+def is_hidden(name):
+    # glob.glob skips dotfiles, keep doing the same
+    return name.startswith(".")
+
+
+class FileIndex:
+    """
+    Persistent index of all files below one or more image roots
+
+    Stores path, size and mtime of every file together with the mtime of
+    every directory. A rescan only lists directories whose mtime changed
+    since the last run, all other directories are served from the index.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._db = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def open(self):
+        if self._db is None:
+            logger.debug("Opening File Index " + self.path)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(SCHEMA)
+        return self._db
+
+    def close(self):
+        if self._db is not None:
+            self._db.commit()
+            self._db.close()
+            self._db = None
+
+    def scan(self, path, extensions, workers=1):
+        return list(self.iter_files(path, extensions, workers))
+
+    def iter_files(self, path, extensions, workers=1, visited=None,
+                   known=()):
+        """
+        Yield all files below path with one of the given extensions
+
+        The index is updated while walking and committed after every
+        directory, so a Watcher writing through its own connection never
+        waits for a whole walk, and an aborted walk only rescans the
+        directories it did not get to.
+        Directories are stat'ed and listed on up to workers threads, the
+        index itself is only touched from the calling thread. visited(d)
+        is called for every directory that still exists. Raises ScanError
+        if path, an indexed directory or one in or above the known ones
+        cannot be read, their rows are kept then.
+        """
+        path = os.path.normpath(path)
+        db = self.open()
+        indexed = dict()
+        children = dict()
+        for d, parent, mtime in db.execute(
+                "SELECT path, parent, mtime FROM dirs"):
+            indexed[d] = mtime
+            children.setdefault(parent, []).append(d)
+
+        def visit(d):
+            try:
+                mtime = os.stat(d).st_mtime_ns
+                if indexed.get(d) == mtime:
+                    return (mtime, None, None), children.get(d, [])
+                entries, subdirs = self._list(d)
+            except OSError as e:
+                if d == path or d in indexed or contains(d, known):
+                    raise ScanError("Cannot read {}: {}".format(d, e)) from e
+                logger.warning("Cannot read {}: {}".format(d, e))
+                return None, []
+            return (mtime, entries, subdirs), subdirs
+
+        stats = {"cached": 0, "listed": 0}
+        try:
+            for d, result in walk(path, visit, workers):
+                if result is None:
+                    self._forget(db, d)
+                    db.commit()
+                    continue
+
+                if visited is not None:
+                    visited(d)
+                mtime, entries, subdirs = result
+                if entries is None:
+                    stats["cached"] += 1
+                    files = [f for f, in db.execute(
+                        "SELECT path FROM files WHERE dir = ?", (d,))]
+                else:
+                    stats["listed"] += 1
+                    files = self._update(db, d, mtime, entries, subdirs,
+                                         children.get(d, []))
+                    db.commit()
+
+                for filename in files:
+                    _, ext = os.path.splitext(filename)
+                    if ext.lower() in extensions:
+                        yield filename
+        finally:
+            db.commit()
+            logger.info("Scanned {} with {} cached and {} listed "
+                        "directories".format(path, stats["cached"],
+                                             stats["listed"]))
+
+    def files(self, path=None):
+        """Return (path, size, mtime) for every indexed file"""
+        db = self.open()
+        if path is None:
+            return db.execute("SELECT path, size, mtime FROM files").fetchall()
+        return db.execute("SELECT path, size, mtime FROM files WHERE dir = ?",
+                          (path,)).fetchall()
+
+    def add_file(self, path):
+        """Add or refresh a single file, e.g. reported by a Watcher"""
+        path = os.path.normpath(path)
+        try:
+            st = os.stat(path)
+        except OSError as e:
+            logger.warning("Cannot stat {}: {}".format(path, e))
+            return
+        db = self.open()
+        db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                   (path, os.path.dirname(path), st.st_size, st.st_mtime_ns))
+        db.commit()
+
+    def remove_path(self, path):
+        """Forget a file or a whole directory"""
+        path = os.path.normpath(path)
+        db = self.open()
+        db.execute("DELETE FROM files WHERE path = ?", (path,))
+        self._forget(db, path)
+        db.commit()
+
+    def _list(self, path):
+        entries = list()
+        subdirs = list()
+        with os.scandir(path) as it:
+            for entry in it:
+                if is_hidden(entry.name):
+                    continue
+                try:
+                    if entry.is_dir():
+                        subdirs.append(os.path.normpath(entry.path))
+                    elif entry.is_file():
+                        st = entry.stat()
+                        entries.append((os.path.normpath(entry.path),
+                                        path, st.st_size, st.st_mtime_ns))
+                except OSError as e:
+                    logger.warning("Cannot stat {}: {}".format(
+                        entry.path, e))
+        return entries, subdirs
+
+    def _update(self, db, path, mtime, entries, subdirs, known_subdirs):
+        # forget directories that are gone since the last scan
+        for subdir in set(known_subdirs) - set(subdirs):
+            self._forget(db, subdir)
+
+        db.execute("DELETE FROM files WHERE dir = ?", (path,))
+        db.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                       entries)
+        db.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)",
+                   (path, os.path.dirname(path), mtime))
+        return [e[0] for e in entries]
+
+    def _forget(self, db, path):
+        for subdir, in db.execute("SELECT path FROM dirs WHERE parent = ?",
+                                  (path,)).fetchall():
+            self._forget(db, subdir)
+        db.execute("DELETE FROM files WHERE dir = ?", (path,))
+        db.execute("DELETE FROM dirs WHERE path = ?", (path,))
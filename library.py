@@ -0,0 +1,247 @@
+import os.path
+import threading
+
+from logger import create_logger
+from scanner import Scanner
+from sources import create_source
+from stats import stats
+from util import PathTable
+from verifier import Quarantine, Verifier
+from watcher import create_watcher
+logger = create_logger(__name__)
+
+
+class Unreachable(OSError):
+    """An image could not be loaded because its directory cannot be read"""
+
+
+class Reconciler:
+    """
+    Compare a rescan with a PathTable restored from disk
+
+    Expects the files of one directory to arrive one after another, like
+    every walk in util does. Files that are not known yet are reported to
+    added(path), known files that were not seen to removed(path).
+    """
+
+    def __init__(self, paths, added, removed):
+        self.paths = paths
+        self.added = added
+        self.removed = removed
+        self._dir = None
+        self._names = dict()
+        self._seen = set()
+
+    def __call__(self, path):
+        d, name = os.path.split(path)
+        if d != self._dir:
+            self._finish_dir()
+            self._dir = d
+            self._names = self.paths.names(d)
+            self._seen.add(d)
+        if self._names.pop(name, None) is None:
+            self.added(path)
+
+    def finish(self):
+        self._finish_dir()
+        for d in self.paths.dirs():
+            if d not in self._seen:
+                for name in self.paths.names(d):
+                    self.removed(os.path.join(d, name))
+
+    def _finish_dir(self):
+        for name in self._names:
+            self.removed(os.path.join(self._dir, name))
+        self._names = dict()
+
+
+class Library:
+    """
+    All images below ScreenConfig.image_path
+
+    Owns the Source and the PathTable and keeps the table current with a
+    Scanner and, if enabled, a Watcher. Subscribers are told about every
+    added and removed index from whichever thread noticed the change, and
+    once the initial scan is complete. The table can be saved to and
+    restored from ScreenConfig.library_path, a restored table is
+    reconciled with the rescan instead of being built from scratch. So is
+    the table when the Watcher lost track of changes. A scan that cannot
+    read the image path or a directory with known images changes nothing
+    and is retried after RETRY seconds, so an unreachable share does not
+    empty the Library.
+    Images that fail to load are kept in a Quarantine, which a Verifier
+    fills ahead of display if enabled. It checks images against the decode
+    budget of max_pixels and max_bytes.
+    """
+
+    # seconds until a failed scan is retried
+    RETRY = 60
+
+    def __init__(self, config, max_pixels=None, max_bytes=None):
+        self.config = config
+        self.source = create_source(config)
+        self.paths = PathTable()
+        self.quarantine = Quarantine(config.quarantine_path)
+        self.restored = False
+        self.scanner = None
+        self.watcher = None
+        self.verifier = None
+        self.max_pixels = max_pixels
+        self.max_bytes = max_bytes
+        self._subscribers = list()
+        self._reconciler = None
+        self._scanning = False
+        self._stale = False
+        self._lock = threading.Lock()
+        # the file index only knows local files
+        self.index_path = None if self.source.remote else config.index_path
+
+    def subscribe(self, added, removed, scanned=None):
+        self._subscribers.append((added, removed, scanned))
+
+    def load(self):
+        """Restore the PathTable saved by the last run"""
+        if self.config.library_path and \
+                self.paths.load(self.config.library_path):
+            logger.info("Restored {} Images from {}".format(
+                len(self.paths), self.config.library_path))
+            self.restored = True
+        self.quarantine.load(self.paths)
+        return self.restored
+
+    def save(self):
+        self.quarantine.save()
+        if not self.config.library_path:
+            return
+        try:
+            self.paths.dump(self.config.library_path)
+        except OSError as e:
+            logger.warning("Cannot save Library: {}".format(e))
+
+    def start(self):
+        if self.config.watch:
+            self.watcher = create_watcher(self.source.path,
+                                          self.config.file_types,
+                                          self.add_new,
+                                          self.remove,
+                                          self.index_path,
+                                          self.config.watch_interval,
+                                          self.source,
+                                          lost=self.rescan)
+            self.watcher.start()
+
+        if self.restored:
+            self.scan(Reconciler(self.paths, self.add_new, self.remove))
+        else:
+            self.scan(self.add)
+        stats.gauge("scanned", lambda: self.scanner.count)
+        stats.gauge("scan_done", lambda: self.scanner.done.is_set())
+
+        if self.config.verify:
+            self.verifier = Verifier(self, self.quarantine,
+                                     self.config.verify_delay,
+                                     self.max_pixels, self.max_bytes)
+            self.verifier.start()
+            stats.gauge("quarantined", lambda: len(self.quarantine))
+
+    def scan(self, callback):
+        """Walk the image path on a new Scanner, reporting to callback"""
+        if isinstance(callback, Reconciler):
+            self._reconciler = callback
+        with self._lock:
+            self._scanning = True
+        visited = None if self.watcher is None else self.watcher.visited
+        self.scanner = Scanner(self.source.path,
+                               self.config.file_types,
+                               callback,
+                               self.index_path,
+                               self.config.scan_workers,
+                               finished=self.scanned,
+                               source=self.source,
+                               visited=visited,
+                               known=self.paths.dirs(),
+                               failed=self.failed)
+        self.scanner.start()
+
+    def rescan(self):
+        """Reconcile the PathTable with a new scan, e.g. after lost events"""
+        with self._lock:
+            if self._scanning:
+                # the running scan cannot tell what it already missed
+                self._stale = True
+                return
+            self._scanning = True
+        logger.info("Rescanning {}".format(self.source.path))
+        self.scan(Reconciler(self.paths, self.add_new, self.remove))
+
+    def scanned(self):
+        if self._reconciler is not None:
+            self._reconciler.finish()
+            self._reconciler = None
+        self.save()
+        for _, _, scanned in self._subscribers:
+            if scanned is not None:
+                scanned()
+        if self.watcher is not None:
+            self.watcher.scanned(self.paths[i] for i in self.paths.indices())
+
+        with self._lock:
+            self._scanning = False
+            stale, self._stale = self._stale, False
+        if stale:
+            self.rescan()
+
+    def reachable(self, path):
+        """
+        Return whether the directory of path can be read
+
+        An unmounted share or a server that is down fails every image,
+        which is no reason to quarantine them. Remote sources are asked
+        for their root, not every server answers HEAD for a directory.
+        """
+        d = self.source.path if self.source.remote else os.path.dirname(path)
+        try:
+            self.source.stat(d)
+        except OSError:
+            return False
+        return True
+
+    def failed(self, error):
+        """The scan was incomplete, keep the table and the index as is"""
+        self._reconciler = None
+        with self._lock:
+            self._scanning = False
+            self._stale = False
+        logger.warning("Keeping {} Images, rescanning in {} s".format(
+            len(self.paths.indices()), self.RETRY))
+        timer = threading.Timer(self.RETRY, self.rescan)
+        timer.daemon = True
+        timer.start()
+
+    def add(self, path):
+        self._added(self.paths.add(path), path)
+
+    def add_new(self, path):
+        image = self.paths.add_new(path)
+        if image is not None:
+            self._added(image, path)
+            return
+        # a known file was rewritten, it may load or fail differently now
+        image = self.paths.find(path)
+        if image is not None:
+            if self.verifier is not None:
+                self.verifier.invalidate(image)
+            self.quarantine.retry(image)
+
+    def _added(self, image, path):
+        self.quarantine.added(image, path)
+        if self.verifier is not None:
+            self.verifier.invalidate(image)
+        for added, _, _ in self._subscribers:
+            added(image)
+
+    def remove(self, path):
+        for image in self.paths.remove(path):
+            self.quarantine.discard(image)
+            for _, removed, _ in self._subscribers:
+                removed(image)
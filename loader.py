@@ -0,0 +1,251 @@
+import os
+import threading
+from contextlib import contextmanager
+
+from logger import create_logger
+from stats import startup, stats
+from util import read_orientation
+logger = create_logger(__name__)
+
+
+# formats that can be decoded at a reduced scale with Image.draft
+DRAFT_FORMATS = ("JPG", "JPEG")
+DRAFT_SCALES = (1, 2, 4, 8)
+
+# orientations that swap width and height
+TRANSPOSED = (5, 6, 7, 8)
+
+# EXIF Orientation to the transpose that displays the image upright, by
+# name so PIL is only imported by the first decode
+ORIENTATIONS = {
+    2: "FLIP_LEFT_RIGHT",
+    3: "ROTATE_180",
+    4: "FLIP_TOP_BOTTOM",
+    5: "TRANSPOSE",
+    6: "ROTATE_270",
+    7: "TRANSVERSE",
+    8: "ROTATE_90",
+}
+
+
+class ImageTooLarge(Exception):
+    """The image cannot be decoded within the memory budget"""
+
+
+def pixel_bytes(mode):
+    """Return the bytes PIL needs to store one pixel of mode"""
+    if mode in ("1", "L", "P"):
+        return 1
+    if mode.startswith("I;16"):
+        return 2
+    return 4
+
+
+def fits(size, mode, max_pixels=None, max_bytes=None):
+    """Return whether a decoded image of size and mode fits the budget"""
+    pixels = size[0] * size[1]
+    return (not max_pixels or pixels <= max_pixels) and \
+        (not max_bytes or pixels * pixel_bytes(mode) <= max_bytes)
+
+
+class DecodeBudget:
+    """
+    Memory shared by every decode of the process
+
+    A decode reserves the pixels and bytes of its decoded image and waits
+    while the decodes already running leave less than its limits, so the
+    decode workers and the Verifier stay within the limits together. An
+    image that does not fit on its own is rejected by fits() beforehand.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self.pixels = 0
+        self.bytes = 0
+
+    @contextmanager
+    def reserve(self, size, mode, max_pixels=None, max_bytes=None):
+        pixels = size[0] * size[1]
+        nbytes = pixels * pixel_bytes(mode)
+
+        def available():
+            return (not max_pixels or self.pixels + pixels <= max_pixels) \
+                and (not max_bytes or self.bytes + nbytes <= max_bytes)
+
+        with self._condition:
+            if not available():
+                stats.count("decode_budget_waits")
+                self._condition.wait_for(available)
+            self.pixels += pixels
+            self.bytes += nbytes
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.pixels -= pixels
+                self.bytes -= nbytes
+                self._condition.notify_all()
+
+
+budget = DecodeBudget()
+
+
+def draft_request(size, target, mode, max_pixels=None, max_bytes=None):
+    """
+    Return the size to pass to Image.draft
+
+    Picks the largest DCT scale that still covers target, or a smaller one
+    if the image would not fit the budget otherwise. Returns None if not
+    even the smallest scale fits.
+    """
+    scales = [s for s in DRAFT_SCALES
+              if s == 1 or (size[0] // s >= target[0] and
+                            size[1] // s >= target[1])]
+    for scale in DRAFT_SCALES[DRAFT_SCALES.index(scales[-1]):]:
+        decoded = (-(-size[0] // scale), -(-size[1] // scale))
+        if fits(decoded, mode, max_pixels, max_bytes):
+            # draft picks the largest scale whose result covers the request
+            return (max(1, size[0] // scale), max(1, size[1] // scale))
+    return None
+
+
+def fit_size(size, width, height, upscale=True):
+    """Return size scaled to fit into width x height keeping aspect ratio"""
+    scale = min(width / size[0], height / size[1])
+    if scale > 1 and not upscale:
+        return size
+    return (max(1, round(size[0] * scale)), max(1, round(size[1] * scale)))
+
+
+def load_image(path, width, height, upscale=True, cache=None,
+               max_pixels=None, max_bytes=None, source=None):
+    """
+    Load an image scaled to fit into width x height
+
+    JPEGs are decoded at the smallest DCT scale that is still at least as
+    large as the target, everything else is reduced before the final
+    LANCZOS resize. The EXIF Orientation is applied as well.
+    With a RenderCache the result is read from and stored in the cache.
+
+    Raises ImageTooLarge instead of decoding more than max_pixels or
+    max_bytes at once, and waits while the other decodes of the process
+    leave less than that. A source reads path from somewhere else than the
+    local filesystem.
+    """
+    if cache is not None:
+        with stats.span("cache_read"):
+            stat = os.stat if source is None else source.stat
+            key = cache.key(path, width, height, upscale, stat=stat)
+            image = cache.get(key)
+        if image is not None:
+            logger.debug("Loaded Image from Render Cache")
+            stats.count("frame_allocations")
+            startup.mark("decode")
+            return image
+
+    image = render_image(path, width, height, upscale, max_pixels,
+                         max_bytes, source)
+
+    if cache is not None:
+        with stats.span("cache_write"):
+            cache.put(key, image)
+    startup.mark("decode")
+    return image
+
+
+def render_image(path, width, height, upscale=True, max_pixels=None,
+                 max_bytes=None, source=None):
+    from PIL import Image
+
+    logger.debug("Loading Image from %s", path)
+    with stats.span("open"):
+        try:
+            image = Image.open(path if source is None else source.open(path))
+        except Image.DecompressionBombError as e:
+            stats.count("images_too_large")
+            raise ImageTooLarge(str(e))
+
+    logger.debug("Format: %s", image.format)
+    logger.debug("Size: %s", image.size)
+    logger.debug("Mode: %s", image.mode)
+
+    with stats.span("exif"):
+        orientation = None
+        if "exif" in image.info:
+            orientation = read_orientation(image.info["exif"])
+    logger.debug("Orientation: %s", orientation)
+
+    # the target box as seen by the stored, not yet rotated image
+    if orientation in TRANSPOSED:
+        width, height = height, width
+    size = fit_size(image.size, width, height, upscale)
+
+    if image.format in DRAFT_FORMATS:
+        request = draft_request(image.size, size, image.mode, max_pixels,
+                                max_bytes)
+        if request is not None and request != image.size:
+            image.draft(image.mode, request)
+            logger.debug("Decoding JPEG at %s", image.size)
+
+    # Image.open only read the header so far
+    if not fits(image.size, image.mode, max_pixels, max_bytes):
+        stats.count("images_too_large")
+        raise ImageTooLarge("{}x{} {} exceeds the decode budget".format(
+            image.width, image.height, image.mode))
+
+    # the full decode is only released once it is scaled down
+    with budget.reserve(image.size, image.mode, max_pixels, max_bytes):
+        with stats.span("decode"):
+            image.load()
+        stats.count("frame_allocations")
+
+        if image.size != size:
+            logger.debug("Resizing Image to %s", size)
+            with stats.span("resize"):
+                image = image.resize(size, Image.LANCZOS, reducing_gap=3.0)
+            stats.count("frame_allocations")
+
+        if orientation is not None:
+            with stats.span("orientation"):
+                image = apply_orientation(image, orientation)
+
+    return image
+
+
+def verify_image(path, max_pixels=None, max_bytes=None, source=None):
+    """
+    Check that path is an intact image, raises if it is not
+
+    JPEGs are decoded at the smallest DCT scale, which still reads every
+    byte of the file but costs a fraction of a full decode. Raises
+    ImageTooLarge for images that exceed the decode budget, which is
+    shared with the decodes for the slideshow.
+    """
+    from PIL import Image
+
+    try:
+        image = Image.open(path if source is None else source.open(path))
+    except Image.DecompressionBombError as e:
+        raise ImageTooLarge(str(e))
+
+    with image:
+        if image.format in DRAFT_FORMATS:
+            image.draft(image.mode, (1, 1))
+        if not fits(image.size, image.mode, max_pixels, max_bytes):
+            raise ImageTooLarge("{}x{} {} exceeds the decode budget".format(
+                image.width, image.height, image.mode))
+        with budget.reserve(image.size, image.mode, max_pixels, max_bytes):
+            image.load()
+
+
+def apply_orientation(image, o):
+    """Apply an EXIF Orientation with a single transpose"""
+    from PIL import Image
+
+    if o not in ORIENTATIONS:
+        if o != 1:
+            logger.error("Unknown Orientation")
+        return image
+    logger.debug("Transposing Image for Orientation %s", o)
+    stats.count("frame_allocations")
+    return image.transpose(getattr(Image, ORIENTATIONS[o]))
@@ -1,12 +1,125 @@
+import atexit
+import copy
+import logging
+import logging.config
+import logging.handlers
+import queue
+import threading
+from collections import deque
 
-def create_logger(name):
-    import yaml
-    import logging
-    import logging.config
+_configured = False
+_lock = threading.Lock()
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    Put records on a queue with only their message merged
+
+    The arguments may change or be freed before the listener gets to them,
+    so the caller merges them into the message. The listener runs in the
+    same process, so formatting and tracebacks are still left to the
+    listener thread.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class RingBufferHandler(logging.Handler):
+    """
+    Keep the last records that are too verbose to be written
+
+    Records of the level of the ring or above that a target would drop
+    are only kept in memory. When a record of flush_level or above
+    arrives, each target first gets the buffered records it dropped, so
+    the context of an error ends up in the log.
+    """
+
+    def __init__(self, targets, capacity=1000, level=logging.NOTSET,
+                 flush_level=logging.ERROR):
+        super().__init__(level)
+        self.targets = targets
+        self.flush_level = flush_level
+        self._records = deque(maxlen=capacity)
+
+    def emit(self, record):
+        if record.levelno >= self.flush_level:
+            self.dump()
+        elif any(record.levelno < target.level for target in self.targets):
+            self._records.append(record)
 
-    # load logger
-    with open("logging.yaml") as logging_yaml:
-        logging.config.dictConfig(yaml.load(logging_yaml))
+    def dump(self):
+        records, self._records = self._records, deque(
+            maxlen=self._records.maxlen)
+        if not records:
+            return
+        for target in self.targets:
+            # Handler.handle does not check the level of the handler
+            for record in records:
+                if record.levelno < target.level:
+                    target.handle(record)
 
-    # create logger
+
+def configure(filename="logging.yaml"):
+    """
+    Configure logging from filename, later calls have no effect
+
+    Called by the entry points before anything is logged, importing a
+    module only creates its logger. The handlers of the root logger are
+    moved behind a queue and run on a listener thread, together with a
+    RingBufferHandler for the records they drop. The ring is set up by
+    the "ring" key of the file, with a level and a capacity.
+    """
+    global _configured
+    with _lock:
+        if _configured:
+            return
+        import yaml
+        with open(filename) as logging_yaml:
+            config = yaml.safe_load(logging_yaml)
+        ring_config = config.pop("ring", {})
+        logging.config.dictConfig(config)
+
+        root = logging.getLogger()
+        handlers = list(root.handlers)
+        # the ring comes first so an error is preceded by its context
+        ring = RingBufferHandler(
+            handlers, capacity=ring_config.get("capacity", 1000),
+            level=ring_config.get("level", logging.DEBUG))
+        records = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(
+            records, ring, *handlers, respect_handler_level=True)
+        for handler in handlers:
+            root.removeHandler(handler)
+        root.addHandler(LazyQueueHandler(records))
+        listener.start()
+        atexit.register(listener.stop)
+        _configured = True
+
+
+def configure_worker(level=logging.WARNING):
+    """
+    Log straight to stderr in a worker process
+
+    A forked process inherits the queue but not the listener thread, so
+    its records would never be written.
+    """
+    global _configured
+    with _lock:
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(
+            "[%(asctime)s][%(processName)s][%(name)s][%(levelname)s] "
+            "%(message)s"))
+        root.addHandler(handler)
+        root.setLevel(level)
+        _configured = True
+
+
+def create_logger(name):
     return logging.getLogger(name)
@@ -1,39 +1,55 @@
 from config import Config
-import toml
+import stats
 import sys
+import threading
 
-from logger import create_logger
+from logger import configure, create_logger
 logger = create_logger("main")
 
 
 def exception_hook(exctype, value, traceback):
-    logger.error(exctype, value, traceback)
+    logger.error("Uncaught Exception", exc_info=(exctype, value, traceback))
     sys._excepthook(exctype, value, traceback)
     sys.exit(1)
 
 
+def thread_exception_hook(args):
+    logger.error("Uncaught Exception in %s", args.thread,
+                 exc_info=(args.exc_type, args.exc_value, args.exc_traceback))
+
+
 def main():
+    configure()
+    stats.startup.mark("import")
+
     logger.debug("Setting Custom Excepthook")
     sys._excepthook = sys.excepthook
     sys.excepthook = exception_hook
+    threading.excepthook = thread_exception_hook
 
     logger.info("Starting Bildschirm")
 
     try:
         logger.info("Loading Config")
+        import toml
         config = Config(toml.load("config.toml"))
     except FileNotFoundError:
-        logger.warn("Config not found falling back to defaults")
+        logger.warning("Config not found falling back to defaults")
         config = Config()
     except Exception as e:
         logger.error("While Loading Config: " + str(e))
         sys.exit(127)
+    stats.startup.mark("config")
+
+    logger.debug("Starting Stats")
+    stats.start(config.stats)
 
     logger.info("Using {} as GUI".format(config.screen.gui))
 
     if config.screen.gui == "Qt":
         logger.debug("Importing required packages for Qt")
         from PyQt5.QtWidgets import QApplication
+        from pipeline import Pipeline
         from qtslide import Slideshow
 
         logger.debug("Creating QApplication")
@@ -43,10 +59,14 @@ def main():
             logger.exception(e)
             sys.exit(127)
 
-        logger.debug("Creating QtSlideshow")
+        logger.debug("Creating QtSlideshows")
         try:
-            slideshow = Slideshow(app, config)
-            slideshow.start()
+            pipeline = Pipeline(config)
+            slideshows = [Slideshow(app, window, pipeline, i)
+                          for i, window in enumerate(config.windows())]
+            stats.startup.mark("gui")
+            for slideshow in slideshows:
+                slideshow.start()
         except Exception as e:
             logger.exception(e)
             sys.exit(127)
@@ -63,8 +83,13 @@ def main():
         from tkslide import Slideshow
 
         logger.debug("Creating TkSlideshow")
+        windows = config.windows()
+        if len(windows) > 1:
+            logger.warning("Tk shows only the first of %d screens",
+                           len(windows))
         try:
-            slideshow = Slideshow(config)
+            slideshow = Slideshow(windows[0])
+            stats.startup.mark("gui")
             slideshow.start()
             logger.info("Exiting")
             sys.exit(0)
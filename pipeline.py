@@ -0,0 +1,73 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from library import Library
+from logger import create_logger
+from rendercache import create_render_cache
+from stats import hit_rate, stats
+from util import create_image_list
+logger = create_logger(__name__)
+
+
+class Pipeline:
+    """
+    Everything the slideshow windows share
+
+    One Library with its scanner and watcher, one image list that all
+    windows draw from, one decode pool and one render cache. Windows
+    subscribe to removed images, to the start, which is the moment to
+    restore their sessions before the scan begins, and to the shutdown.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.library = Library(config.screen,
+                               config.slideshow.max_image_pixels,
+                               config.slideshow.max_image_bytes)
+        self.image_list = None
+        self.started = False
+        self._subscribers = list()
+
+        logger.debug("Setting up Render Cache")
+        self.render_cache = create_render_cache(config.cache)
+        if self.render_cache is not None:
+            stats.gauge("render_cache_hit_rate",
+                        lambda: hit_rate(self.render_cache.hits,
+                                         self.render_cache.misses))
+
+        logger.debug("Setting up Decode Pool")
+        self.pool = ThreadPoolExecutor(
+            max_workers=config.slideshow.decode_workers,
+            thread_name_prefix="Decode")
+
+    def subscribe(self, removed, starting=None, stopping=None):
+        self._subscribers.append((removed, starting, stopping))
+
+    def start(self):
+        """Create the image list and start scanning, only once"""
+        if self.started:
+            return
+        self.started = True
+
+        self.library.load()
+        self.image_list = create_image_list(
+            self.config.slideshow.shuffle, self.library.paths.indices(),
+            self.library.quarantine.__contains__)
+        self.library.subscribe(self.image_list.add, self.remove_image,
+                               getattr(self.image_list, "settle", None))
+        for _, starting, _ in self._subscribers:
+            if starting is not None:
+                starting()
+        self.library.start()
+
+    def remove_image(self, image):
+        """Drop image from the image list and from every window"""
+        self.image_list.remove(image)
+        for removed, _, _ in self._subscribers:
+            removed(image)
+
+    def shutdown(self):
+        for _, _, stopping in self._subscribers:
+            if stopping is not None:
+                stopping()
+        self.pool.shutdown(wait=False)
+        self.library.save()
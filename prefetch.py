@@ -0,0 +1,105 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from logger import create_logger
+logger = create_logger(__name__)
+
+
+class Prefetcher:
+    """
+    Decode images on worker threads ahead of time
+
+    load(key) is run on the pool for every requested key. The resulting
+    futures are kept until the key is no longer part of a prefetch request.
+    A request can hold back one key until lead_time(key) seconds before it
+    is due, so it is decoded just in time without occupying memory for a
+    whole interval. Several Prefetchers can share one pool, only its owner
+    shuts it down.
+    """
+
+    def __init__(self, load, workers=2, pool=None, lead_time=None):
+        self.load = load
+        self.lead_time = lead_time
+        self._owner = pool is None
+        if pool is None:
+            pool = ThreadPoolExecutor(max_workers=workers,
+                                      thread_name_prefix="Decode")
+        self._pool = pool
+        self._futures = OrderedDict()
+        self._ahead = None
+        self._due = None
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the future for key, submitting it if necessary"""
+        with self._lock:
+            return self._submit(key)
+
+    def prefetch(self, keys, ahead=None, due=None):
+        """
+        Keep and start decoding keys, drop everything else
+
+        ahead is kept as well but only started lead_time(ahead) seconds
+        before due, a time.perf_counter() value, see schedule().
+        """
+        with self._lock:
+            for key in list(self._futures):
+                if key not in keys and key != ahead:
+                    logger.debug("Dropping prefetched %s", key)
+                    self._futures.pop(key).cancel()
+            for key in keys:
+                self._submit(key)
+            self._ahead = ahead
+            if due is not None:
+                self._due = due
+            self._arm()
+
+    def schedule(self, due):
+        """Move the time the key held back is due, e.g. after a reset"""
+        with self._lock:
+            self._due = due
+            self._arm()
+
+    def shutdown(self):
+        with self._lock:
+            self._ahead = None
+            self._arm()
+            for future in self._futures.values():
+                future.cancel()
+            self._futures.clear()
+        if self._owner:
+            self._pool.shutdown(wait=False)
+
+    def _arm(self):
+        """Start the key held back once its lead time is reached"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        key = self._ahead
+        if key is None or key in self._futures or self._due is None:
+            return
+        lead = self.lead_time(key) if self.lead_time is not None else 0
+        delay = self._due - lead - time.perf_counter()
+        if delay <= 0:
+            self._submit(key)
+            return
+        logger.debug("Prefetching %s in %.3f s", key, delay)
+        self._timer = threading.Timer(delay, self._start, (key,))
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _start(self, key):
+        with self._lock:
+            if key == self._ahead and key not in self._futures:
+                self._submit(key)
+
+    def _submit(self, key):
+        future = self._futures.get(key)
+        if future is None:
+            logger.debug("Prefetching %s", key)
+            future = self._pool.submit(self.load, key)
+            self._futures[key] = future
+        return future
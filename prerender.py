@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Render the image library ahead of time at screen resolution
+
+Every image below ScreenConfig.image_path is scaled to fit the screen,
+turned upright and re-encoded into a mirror tree at PrerenderConfig.path.
+The file names of the renditions carry the size and quality they were
+rendered with. Sources that did not change since the last run with the
+same settings are skipped, renditions without a source or with other
+settings are removed. Point ScreenConfig.image_path at the mirror to show
+it without decoding the originals.
+
+    python prerender.py
+    python prerender.py --quality 85 --workers 4
+"""
+
+import argparse
+import os
+import os.path
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from config import Config
+from loader import render_image
+from logger import configure, configure_worker, create_logger
+from util import ScanError, get_files, iter_files
+logger = create_logger("prerender")
+
+# extensions of the renditions and their format
+FORMATS = {".jpg": "JPEG", ".png": "PNG"}
+
+
+def rendition_tag(ext, width, height, quality, upscale=False):
+    """Return the render settings of a rendition with extension ext"""
+    tag = "{}x{}".format(width, height)
+    if upscale:
+        tag += "-up"
+    if FORMATS[ext] == "JPEG":
+        tag += "-q{}".format(quality)
+    return tag
+
+
+def mirror_path(source, root, output, ext, tag):
+    """Return where the rendition of source with extension ext is stored"""
+    rel = os.path.relpath(source, root)
+    stem, source_ext = os.path.splitext(rel)
+    if source_ext.lower() == ext:
+        rel = stem
+    return os.path.join(output, "{}.{}{}".format(rel, tag, ext))
+
+
+def find_rendition(source, root, output, width, height, quality,
+                   upscale=False):
+    """Return the rendition of source if it is up to date, None otherwise"""
+    mtime = os.stat(source).st_mtime_ns
+    for ext in FORMATS:
+        target = mirror_path(source, root, output, ext,
+                             rendition_tag(ext, width, height, quality,
+                                           upscale))
+        try:
+            if os.stat(target).st_mtime_ns == mtime:
+                return target
+        except FileNotFoundError:
+            pass
+    return None
+
+
+def render(source, root, output, width, height, quality, max_pixels=None,
+           max_bytes=None, upscale=False):
+    """Render source into the mirror, runs in a worker process"""
+    st = os.stat(source)
+    image = render_image(source, width, height, upscale=upscale,
+                         max_pixels=max_pixels, max_bytes=max_bytes)
+
+    if image.mode not in ("RGB", "L", "RGBA", "LA", "P"):
+        image = image.convert("RGBA" if "A" in image.mode else "RGB")
+    if image.mode in ("RGB", "L"):
+        ext, params = ".jpg", {"quality": quality}
+    else:
+        ext, params = ".png", {}
+
+    target = mirror_path(source, root, output, ext,
+                         rendition_tag(ext, width, height, quality, upscale))
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp = "{}.{}.tmp".format(target, os.getpid())
+    try:
+        image.save(tmp, FORMATS[ext], **params)
+        # the mtime of the source marks the rendition as up to date
+        os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.replace(tmp, target)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+    # the format changes if e.g. transparency was added to the source
+    for other in FORMATS:
+        stale = mirror_path(source, root, output, other,
+                            rendition_tag(other, width, height, quality,
+                                          upscale))
+        if other != ext and os.path.exists(stale):
+            os.remove(stale)
+    return target
+
+
+def remove_stale(output, renditions):
+    """
+    Remove files and empty directories of the mirror that are not needed
+
+    Temporary files of renders that were killed are removed as well.
+    """
+    removed = 0
+    for filename in iter_files(output, list(FORMATS) + [".tmp"]):
+        if filename not in renditions:
+            logger.debug("Removing %s", filename)
+            os.remove(filename)
+            removed += not filename.endswith(".tmp")
+    for d, subdirs, files in os.walk(output, topdown=False):
+        if d != output and not subdirs and not files:
+            os.rmdir(d)
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--config", default="config.toml")
+    parser.add_argument("--output", help="overrides prerender.path")
+    parser.add_argument("--quality", type=int,
+                        help="overrides prerender.quality")
+    parser.add_argument("--workers", type=int,
+                        help="overrides prerender.workers")
+    args = parser.parse_args()
+    configure()
+
+    import toml
+    try:
+        config = Config(toml.load(args.config))
+    except FileNotFoundError:
+        logger.warning("Config not found falling back to defaults")
+        config = Config()
+
+    screen = config.screen
+    root = os.path.normpath(screen.image_path)
+    output = os.path.normpath(args.output or config.prerender.path)
+    quality = args.quality or config.prerender.quality
+    workers = args.workers or config.prerender.workers or os.cpu_count()
+
+    logger.info("Scanning %s", root)
+    inside = os.path.join(os.path.abspath(output), "")
+    try:
+        files = get_files(root, screen.file_types, screen.index_path,
+                          screen.scan_workers, strict=True)
+    except ScanError as e:
+        # renditions of images that are only unreachable are not stale
+        logger.error("Cannot scan %s: %s", root, e)
+        return 1
+    sources = [s for s in files if not os.path.abspath(s).startswith(inside)]
+
+    renditions = set()
+    pending = list()
+    for source in sources:
+        target = find_rendition(source, root, output, screen.width,
+                                screen.height, quality)
+        if target is None:
+            pending.append(source)
+        else:
+            renditions.add(target)
+    logger.info("Rendering %d of %d Images at %dx%d with %d workers",
+                len(pending), len(sources), screen.width, screen.height,
+                workers)
+
+    failed = 0
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=configure_worker) as pool:
+        futures = {pool.submit(render, source, root, output, screen.width,
+                               screen.height, quality,
+                               config.slideshow.max_image_pixels,
+                               config.slideshow.max_image_bytes): source
+                   for source in pending}
+        for i, future in enumerate(as_completed(futures), 1):
+            try:
+                renditions.add(future.result())
+            except Exception as e:
+                logger.warning("Cannot render %s: %s", futures[future], e)
+                failed += 1
+            if i % 100 == 0:
+                logger.info("Rendered %d of %d Images", i, len(pending))
+
+    removed = remove_stale(output, renditions) \
+        if os.path.isdir(output) else 0
+    logger.info("Rendered %d, skipped %d, failed %d and removed %d Images",
+                len(pending) - failed, len(sources) - len(pending), failed,
+                removed)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
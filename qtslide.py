@@ -1,30 +1,121 @@
-from PyQt5.QtCore import Qt, QTimer
-from PyQt5.QtGui import QPixmap
+import sys
+import time
+
+from PyQt5.QtCore import Qt, QTimer, pyqtSignal
+from PyQt5.QtGui import QImage, QPixmap
 from PyQt5.QtWidgets import QAction, QLabel, QMainWindow
-from PIL import ImageQt, Image
 
 from config import Config
+from library import Unreachable
+from loader import ImageTooLarge, load_image
 from logger import create_logger
-from util import History, RandomImageList, get_files, getExif
+from pipeline import Pipeline
+from prefetch import Prefetcher
+from scheduler import Scheduler
+from session import Session
+from stats import startup, stats
+from transition import Crossfade
+from util import History, LRUCache
 
 logger = create_logger(__name__)
 
 
-class Slideshow(QMainWindow):
-    image_path = str()
-    timer = QTimer()
+# raw PIL modes matching the memory layout of QImage.Format_(A)RGB32
+if sys.byteorder == "little":
+    RGB32, ARGB32 = "BGRX", "BGRA"
+else:
+    RGB32, ARGB32 = "XRGB", "ARGB"
+
+
+def pixmapSize(pixmap):
+    return pixmap.width() * pixmap.height() * pixmap.depth() // 8
+
+
+def entrySize(entry):
+    """Return the bytes of a cached (pixmap, qimage or None) pair"""
+    pixmap, image = entry
+    size = pixmapSize(pixmap)
+    if image is not None:
+        size += image.bytesPerLine() * image.height()
+    return size
+
+
+class BufferImage(QImage):
+    """QImage that keeps the buffer it wraps alive"""
+
+    def __init__(self, data, width, height, bytes_per_line, fmt):
+        super().__init__(data, width, height, bytes_per_line, fmt)
+        self._data = data
+
+
+def toQImage(image):
+    """
+    Wrap a PIL Image in a QImage
+
+    The pixels are packed once into Qt's native 32 bit layout and wrapped
+    without another copy, so QPixmap.fromImage needs no conversion either.
+    """
+    if image.mode not in ("RGB", "RGBA"):
+        stats.count("frame_allocations")
+        has_alpha = "A" in image.mode or "transparency" in image.info
+        image = image.convert("RGBA" if has_alpha else "RGB")
+
+    if image.mode == "RGBA":
+        data = image.tobytes("raw", ARGB32)
+        fmt = QImage.Format_ARGB32
+    else:
+        data = image.tobytes("raw", RGB32)
+        fmt = QImage.Format_RGB32
+    stats.count("frame_allocations")
+    return BufferImage(data, image.width, image.height, image.width * 4, fmt)
+
 
-    def __init__(self, app, _config: Config):
+class SlideLabel(QLabel):
+    """
+    QLabel that reports how long it took to paint itself
+
+    update() only schedules a paint, the slide is on screen once
+    paintEvent returns.
+    """
+
+    painted = pyqtSignal(float)
+
+    def paintEvent(self, event):
+        start = time.perf_counter()
+        super().paintEvent(event)
+        self.painted.emit(time.perf_counter() - start)
+
+
+class Slideshow(QMainWindow):
+    image = None
+    session = None
+    # the next paint of the slide lands the transition
+    landing = False
+    imageReady = pyqtSignal(int, object)
+    imageRemoved = pyqtSignal(int)
+
+    def __init__(self, app, _config: Config, pipeline=None, index=0):
         self.app = app
         self.config = _config
-
-        self.history = History(maxlen=self.config.slideshow.history_length)
+        self.index = index
+
+        if pipeline is None:
+            pipeline = Pipeline(self.config)
+        self.pipeline = pipeline
+        self.library = pipeline.library
+        self.paths = self.library.paths
+        self.history = History(maxlen=self.config.slideshow.history_length,
+                               skip=self.library.quarantine.__contains__)
+        # pixmaps with their QImage if a transition blends them
+        self.pixmap_cache = LRUCache(self.config.slideshow.pixmap_cache_size,
+                                     entrySize)
 
         logger.debug("Creating Window")
         super().__init__()
 
         logger.debug("Creating Slide QLabel")
-        self.slide = QLabel()
+        self.slide = SlideLabel()
+        self.slide.painted.connect(self.painted)
 
         logger.debug("Setting Slide Alignment to Center")
         self.slide.setAlignment(Qt.AlignCenter)
@@ -32,6 +123,15 @@ class Slideshow(QMainWindow):
         logger.debug("Set Slide Background Color to black")
         self.slide.setStyleSheet("background-color: black;")
 
+        screens = self.app.screens()
+        if self.config.screen.screen is not None and \
+                self.config.screen.screen < len(screens):
+            logger.info("Placing Window on Screen %d",
+                        self.config.screen.screen)
+            geometry = screens[self.config.screen.screen].geometry()
+            self.slide.move(geometry.topLeft())
+        self.slide.resize(self.config.screen.width, self.config.screen.height)
+
         logger.info("Setting Fullscreen to " +
                     str(self.config.slideshow.fullscreen))
         if self.config.slideshow.fullscreen:
@@ -41,9 +141,42 @@ class Slideshow(QMainWindow):
 
         self.slide.show()
 
-        logger.debug("Setting up Slideshow Timer")
+        self.crossfade = None
+        transition = self.config.slideshow.transition
+        if transition == "crossfade":
+            logger.info("Crossfading for %.1f s at %d fps",
+                        self.config.slideshow.transition_duration,
+                        self.config.slideshow.transition_fps)
+            self.crossfade = Crossfade(
+                self.slide, self.config.screen.width,
+                self.config.screen.height,
+                self.config.slideshow.transition_duration,
+                self.config.slideshow.transition_fps)
+            self.crossfade.finished.connect(self.fadeFinished)
+        elif transition != "cut":
+            logger.warning("Unknown transition %s, cutting", transition)
+
+        logger.debug("Setting up Slideshow Timers")
+        self.scheduler = Scheduler(self.config.slideshow.interval)
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
         self.timer.timeout.connect(self.tick)
 
+        self.render_cache = pipeline.render_cache
+
+        logger.debug("Setting up Prefetcher")
+        self.prefetcher = Prefetcher(self.decodeImage, pool=pipeline.pool,
+                                     lead_time=self.leadTime)
+        self.imageReady.connect(self.showImage)
+        self.imageRemoved.connect(self.forgetImage)
+        pipeline.subscribe(self.imageRemoved.emit, self.restoreSession,
+                           self.stop)
+
+        logger.debug("Registering Stats")
+        stats.gauge("pixmap_cache_bytes" + ("_{}".format(index)
+                                            if index else ""),
+                    lambda: self.pixmap_cache.bytes)
+
         logger.debug("Setting Actions")
 
         logger.debug("Creating Previous Image Action")
@@ -74,26 +207,44 @@ class Slideshow(QMainWindow):
 
     def resetTimer(self):
         logger.debug("Resetting Timer")
-        self.timer.setInterval(self.config.slideshow.interval * 1000)
-        logger.debug(self.timer.interval() / 1000)
+        self.scheduler.reset()
+        self.scheduleNextImage()
+
+    def scheduleNextImage(self):
+        """Start the timer for showing the next image"""
+        remaining = self.scheduler.remaining()
+        logger.debug("Next Image due in %.3f s", remaining)
+        self.prefetcher.schedule(self.scheduler.deadline)
+        self.timer.start(int(remaining * 1000))
+
+    def leadTime(self, image):
+        """Return how long before its deadline image starts decoding"""
+        path = self.paths[image]
+        return 0 if path is None else self.scheduler.lead_time(path)
 
     def tick(self):
         logger.debug("Timer Tick Received")
-        self.nextImage()
+        self.scheduler.advance()
+        self.showNextImage()
+        self.scheduleNextImage()
 
     def prevImage(self):
         logger.debug("Trying to get previous Image")
         if self.history.hasPrev():
-            logger.info("Loading previous Image from History "
-                        "[{}/{}]".format(self.history.cursor,
-                                         self.history.size()))
+            logger.info("Loading previous Image from History [%d/%d]",
+                        self.history.cursor, self.history.size())
             self.setImage(self.history.prev())
         else:
             logger.info("Cannot get previous Image. "
                         "Already at oldest available Image")
+        self.saveSession()
         self.resetTimer()
 
     def nextImage(self):
+        self.showNextImage()
+        self.resetTimer()
+
+    def showNextImage(self):
         logger.debug("Trying to get next Image")
         if self.history.hasNext():
             logger.info("Loading next Image from History")
@@ -102,116 +253,245 @@ class Slideshow(QMainWindow):
             except IndexError as e:
                 logger.exception(e)
                 return self.quit(127)
-            logger.debug("History Pointer Position: " +
-                         str(self.history.cursor))
+            logger.debug("History Pointer Position: %d", self.history.cursor)
             self.setImage(image)
         else:
             logger.info("Loading Image from List")
-            image = self.image_list.next()
+            try:
+                image = self.image_list.next()
+            except IndexError as e:
+                # e.g. every image is quarantined, try again on the next tick
+                logger.warning("No Image to show: %s", e)
+                return
             self.history.push(image)
             self.setImage(image)
-        self.resetTimer()
+        self.saveSession()
 
     def quit(self, code=0):
         logger.info("Quitting")
+        self.pipeline.shutdown()
         self.app.exit(code)
 
-    def setImage(self, image_path):
-        if self.image_path == image_path:
-            logger.warn("Image already set. Skipping.")
+    def stop(self):
+        self.timer.stop()
+        if self.crossfade is not None:
+            self.crossfade.shutdown()
+        self.prefetcher.shutdown()
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+    def setImage(self, image):
+        if self.image == image:
+            logger.warning("Image already set. Skipping.")
             return
 
         logger.debug("Setting new Image")
-        self.image_path = image_path
-
-        logger.debug("Loading Image from " + str(image_path))
-        image = Image.open(self.image_path)
-
-        logger.debug("Format: " + image.format)
-        logger.debug("Size: " + str(image.size))
-        logger.debug("Mode: " + image.mode)
-
-        if image.format in ["JPG", "JPEG"]:
-            logger.debug("Getting EXIF Data from image")
-            exif = getExif(image)
-
-            logger.debug("Image EXIF: " + str(exif))
-
-            if exif and "Orientation" in exif:
-                logger.debug("Found Orientation in EXIF")
-                pixmap = self.applyExifOrientation(image, exif)
+        self.image = image
+        self.transition_start = time.perf_counter()
+
+        entry = self.pixmap_cache.get(image)
+        if entry is not None:
+            logger.debug("Using cached Pixmap")
+            stats.count("pixmap_cache_hits")
+            self.paint(*entry)
+            self.prefetchImages()
+            return
+        stats.count("pixmap_cache_misses")
 
-        logger.debug("Converting Image to ImageQt")
-        imageqt = ImageQt.ImageQt(image)
+        future = self.prefetcher.get(image)
+        if future.done():
+            self.showImage(image, future)
+        else:
+            logger.debug("Waiting for Image to be decoded")
+            future.add_done_callback(
+                lambda f: self.imageReady.emit(image, f))
 
-        logger.debug("Converting ImageQt to QPixmap")
-        pixmap = QPixmap.fromImage(imageqt)
+        self.prefetchImages()
 
-        logger.debug("Scaling Image to fit " +
-                     str(self.config.screen.width) + "x" +
-                     str(self.config.screen.height) +
-                     " while keeping Aspect Ratio")
-        pixmap = pixmap.scaled(self.config.screen.width,
-                               self.config.screen.height,
-                               Qt.KeepAspectRatio,
-                               Qt.SmoothTransformation)
+    def showImage(self, image, future):
+        if image != self.image:
+            logger.debug("Image changed while decoding. Skipping.")
+            return
+        if future.cancelled():
+            return
 
+        try:
+            qimage = future.result()
+        except ImageTooLarge as e:
+            logger.warning("Skipping %s: %s", self.paths[image], e)
+            return self.skipImage(image)
+        except Unreachable as e:
+            # keep the slide on screen, the next tick tries another one
+            logger.warning("Cannot load %s: %s", self.paths[image], e)
+            return
+        except Exception as e:
+            logger.warning("Cannot load %s: %s", self.paths[image], e)
+            self.library.quarantine.add(image, self.paths[image], e)
+            return self.skipImage(image, remove=False)
+        self.library.quarantine.release(image)
+
+        logger.debug("Converting QImage to QPixmap")
+        with stats.span("to_pixmap"):
+            pixmap = QPixmap.fromImage(qimage)
+        stats.count("frame_allocations")
+        if self.crossfade is None:
+            qimage = None
+        self.pixmap_cache.put(image, (pixmap, qimage))
+        self.paint(pixmap, qimage)
+
+    def paint(self, pixmap, qimage=None):
         logger.debug("Setting Slide Pixmap")
-        self.slide.setPixmap(pixmap)
-
-    def applyExifOrientation(self, image, exif):
-        o = exif["Orientation"]
-        if o == 1:
-            pass
-        elif o == 2:
-            logger.debug("Mirroring Image horizontally")
-            # mirror horizontal
-            image = image.transpose(Image.FLIP_LEFT_RIGHT)
-        elif o == 3:
-            logger.debug("Rotating Image by 180 degree")
-            # rotate 180 degree
-            image = image.transpose(Image.ROTATE_180)
-        elif o == 4:
-            logger.debug("Mirroring Image vertically")
-            # mirror vertical
-            image = image.transpose(Image.FLIP_TOP_BOTTOM)
-        elif o == 5:
-            logger.debug("Mirroring Image horizontally and "
-                         "rotating by 270 degree")
-            # mirror horizontal
-            image = image.transpose(Image.FLIP_LEFT_RIGHT)
-            # rotate 270 degree
-            image = image.transpose(Image.ROTATE_270)
-        elif o == 6:
-            logger.debug("Rotating Image by 270 degree")
-            # rotate 270 degree
-            image = image.transpose(Image.ROTATE_270)
-        elif o == 7:
-            logger.debug("Mirroring Image horizontally and "
-                         "rotating by 90 degree")
-            # mirror horizontal
-            image = image.transpose(Image.FLIP_LEFT_RIGHT)
-            # rotate 90 degree
-            image = image.transpose(Image.ROTATE_90)
-        elif o == 8:
-            logger.debug("Rotating Image by 90 degree")
-            # rotate 90 degree
-            image = image.transpose(Image.ROTATE_90)
+        if self.crossfade is not None:
+            self.landing = False
+            self.crossfade.show(pixmap, qimage)
         else:
-            logger.error("Unknown Orientation")
+            self.slide.setPixmap(pixmap)
+            self.landing = True
+            self.slide.update()
+
+    def fadeFinished(self):
+        """The last frame of the fade is set, land at its paint"""
+        self.landing = True
+        self.slide.update()
+
+    def painted(self, seconds):
+        stats.add("paint", seconds)
+        if self.landing:
+            self.landing = False
+            self.landed()
+
+    def landed(self):
+        """The new slide is completely on screen"""
+        stats.add("transition", time.perf_counter() - self.transition_start)
+        self.scheduler.landed(0.0 if self.crossfade is None
+                              else self.crossfade.duration)
+        startup.mark("paint")
+
+    def upcomingImages(self, n):
+        upcoming = self.history.peek(n)
+        if len(upcoming) < n:
+            upcoming += self.image_list.peek(n - len(upcoming))
+        return upcoming
+
+    def prefetchImages(self):
+        prefetch = self.config.slideshow.prefetch
+        upcoming = self.upcomingImages(max(1, prefetch))
+        # without prefetching the next image still starts before its deadline
+        ahead = upcoming[0] if upcoming and not prefetch else None
+        self.prefetcher.prefetch(
+            [x for x in [self.image] + upcoming[:prefetch]
+             if x not in self.pixmap_cache],
+            None if ahead in self.pixmap_cache else ahead,
+            self.scheduler.deadline)
+
+        # forget pixmaps that dropped out of the history
+        self.pixmap_cache.retain(self.history)
+
+        if self.library.verifier is not None:
+            self.library.verifier.ahead(
+                self.upcomingImages(self.library.verifier.AHEAD))
+
+    def decodeImage(self, image):
+        """Load and scale an image, runs on a decode worker"""
+        path = self.paths[image]
+        start = time.perf_counter()
+        try:
+            image = load_image(
+                path,
+                self.config.screen.width,
+                self.config.screen.height,
+                cache=self.render_cache,
+                max_pixels=self.config.slideshow.max_image_pixels,
+                max_bytes=self.config.slideshow.max_image_bytes,
+                source=self.library.source)
+        except ImageTooLarge:
+            raise
+        except Exception as e:
+            if not self.library.reachable(path):
+                raise Unreachable(str(e)) from e
+            raise
+
+        logger.debug("Converting Image to QImage")
+        with stats.span("to_qimage"):
+            image = toQImage(image)
+        self.scheduler.observe(path, time.perf_counter() - start)
         return image
 
-    def populateImageList(self):
-        files = get_files(self.config.screen.image_path,
-                          self.config.screen.file_types)
-        if not files or len(files) == 0:
+    @property
+    def image_list(self):
+        return self.pipeline.image_list
+
+    def restoreSession(self):
+        if not self.config.slideshow.session_path:
+            return
+        self.session = Session(self.config.slideshow.session_path,
+                               self.config.slideshow.history_length)
+        state = self.session.load()
+        if state is None or not self.library.restored:
+            return
+
+        logger.info("Restoring Session")
+        self.history.restore([x for x in state["history"]
+                              if 0 <= x < len(self.paths) and
+                              self.paths[x] is not None], state["cursor"])
+        # the windows share one image list, the first one restores it
+        if self.index == 0 and state["cycle"] and \
+                hasattr(self.image_list, "restore"):
+            if not self.image_list.restore(state["cycle"]):
+                logger.info("Library changed, starting a new cycle")
+        self.session.sync(self.history, self.image_list)
+
+    def saveSession(self):
+        if self.session is not None:
+            self.session.record(self.history, self.image_list)
+
+    def skipImage(self, image, remove=True):
+        """
+        Drop an image that cannot be shown and show another one
+
+        A quarantined image stays in the image list, which skips it until
+        its backoff expired.
+        """
+        latest = not self.history.hasNext()
+        if remove:
+            # every window forgets it, this one included
+            self.pipeline.remove_image(image)
+        else:
+            self.forgetImage(image)
+        if len(self.image_list) == 0:
+            logger.error("Image List is empty")
+        elif latest or self.history.size() == 0:
+            self.showNextImage()
+        else:
+            self.setImage(self.history.current())
+
+    def forgetImage(self, image):
+        logger.debug("Removing deleted Image from History")
+        self.history.remove(image)
+        self.pixmap_cache.pop(image)
+        if self.session is not None:
+            self.session.sync(self.history, self.image_list)
+
+    def waitForFirstImage(self):
+        if self.history.size() > 0 or len(self.image_list) > 0:
+            startup.mark("scan")
+
+        if self.history.size() > 0:
+            logger.info("Resuming with Image from History")
+            self.setImage(self.history.current())
+        elif len(self.image_list) > 0:
+            self.nextImage()
+        elif self.library.scanner.done.is_set():
             logger.error("Image List is empty")
             return self.quit()
-        self.image_list = RandomImageList(files)
+        else:
+            return QTimer.singleShot(100, self.waitForFirstImage)
+
+        logger.info("Starting Slideshow")
+        self.resetTimer()
 
     def start(self):
         logger.info("Populating Image List")
-        self.populateImageList()
-        self.nextImage()
-        logger.info("Starting Slideshow")
-        self.timer.start(self.config.slideshow.interval * 1000)
+        self.pipeline.start()
+        self.waitForFirstImage()
@@ -0,0 +1,165 @@
+import hashlib
+import os
+import os.path
+import threading
+from collections import OrderedDict
+
+from logger import create_logger
+logger = create_logger(__name__)
+
+
+class DiskCache:
+    """
+    Directory of cache entries whose total size stays below max_bytes
+
+    The least recently used entries are evicted first. Recency survives
+    restarts through the file mtime. Entries are named by their key and
+    one of SUFFIXES.
+    """
+
+    SUFFIXES = ("",)
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        entries = list()
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(".tmp"):
+                    os.remove(entry.path)
+                    continue
+                st = entry.stat()
+                entries.append((st.st_mtime, entry.name, st.st_size))
+        for _, name, size in sorted(entries):
+            self._entries[name] = size
+            self._bytes += size
+        logger.info("{} holds {} entries with {} bytes".format(
+            type(self).__name__, len(self._entries), self._bytes))
+        self._evict()
+
+    def _open(self, key):
+        """Return the filename of the entry for key or None"""
+        with self._lock:
+            name = self._find(key)
+            if name is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(name)
+            self.hits += 1
+
+        filename = os.path.join(self.directory, name)
+        try:
+            os.utime(filename)
+        except OSError:
+            self._remove(name)
+            return None
+        return filename
+
+    def _write(self, name, write):
+        """Store an entry, write(filename) creates the file"""
+        filename = os.path.join(self.directory, name)
+        tmp = "{}.{}.tmp".format(filename, threading.get_ident())
+        try:
+            write(tmp)
+            os.replace(tmp, filename)
+            size = os.path.getsize(filename)
+        except OSError as e:
+            logger.warning("Cannot write cache entry {}: {}".format(name, e))
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+
+        with self._lock:
+            self._bytes += size - self._entries.pop(name, 0)
+            self._entries[name] = size
+            self._evict()
+
+    def _find(self, key):
+        for suffix in self.SUFFIXES:
+            if key + suffix in self._entries:
+                return key + suffix
+        return None
+
+    def _remove(self, name):
+        with self._lock:
+            self._bytes -= self._entries.pop(name, 0)
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except OSError:
+            pass
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._entries:
+            name, size = self._entries.popitem(last=False)
+            self._bytes -= size
+            logger.debug("Evicting %s", name)
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+
+class RenderCache(DiskCache):
+    """
+    On-disk cache of screen-sized, orientation-corrected renditions
+
+    Entries are keyed by source path, size, mtime and target resolution,
+    so a changed source or screen never hits a stale rendition.
+    """
+
+    SUFFIXES = (".jpg", ".png")
+
+    def __init__(self, directory, max_bytes, quality=90):
+        self.quality = quality
+        super().__init__(directory, max_bytes)
+
+    def key(self, path, *params, stat=os.stat):
+        """Return the key of path rendered with params, e.g. the size"""
+        st = stat(path)
+        raw = "\0".join(str(x) for x in
+                        (path, st.st_size, st.st_mtime_ns) + params)
+        return hashlib.sha1(raw.encode("utf-8", "surrogateescape")).hexdigest()
+
+    def get(self, key):
+        """Return the cached image for key or None"""
+        from PIL import Image
+
+        filename = self._open(key)
+        if filename is None:
+            return None
+        try:
+            image = Image.open(filename)
+            image.load()
+        except OSError as e:
+            name = os.path.basename(filename)
+            logger.warning("Dropping broken cache entry {}: {}".format(
+                name, e))
+            self._remove(name)
+            return None
+        return image
+
+    def put(self, key, image):
+        if image.mode in ("RGB", "L"):
+            name, fmt, params = key + ".jpg", "JPEG", {"quality": self.quality}
+        else:
+            name, fmt, params = key + ".png", "PNG", {}
+        self._write(name, lambda filename: image.save(filename, fmt,
+                                                      **params))
+
+
+def create_render_cache(config):
+    """Create the RenderCache described by a CacheConfig, if enabled"""
+    if not config.render_path:
+        return None
+    return RenderCache(config.render_path, config.render_size,
+                       config.render_quality)
@@ -0,0 +1,63 @@
+import threading
+
+from logger import create_logger
+from util import ScanError
+logger = create_logger(__name__)
+
+
+class Scanner(threading.Thread):
+    """
+    Walk the image path on a background thread
+
+    Every file found is handed to callback right away, so consumers can
+    start working with the first hits while the walk continues. finished
+    is called on the same thread once the walk is complete, visited(d)
+    for every directory walked. If the path or one of the known
+    directories cannot be read the walk is incomplete, failed(error) is
+    called instead of finished. Without a source the path is walked on the
+    local filesystem.
+    """
+
+    def __init__(self, path, extensions, callback, index_path=None,
+                 workers=1, finished=None, source=None, visited=None,
+                 known=(), failed=None):
+        super().__init__(name="Scanner", daemon=True)
+        self.path = path
+        self.extensions = extensions
+        self.callback = callback
+        self.index_path = index_path
+        self.workers = workers
+        self.finished = finished
+        self.visited = visited
+        self.known = known
+        self.failed = failed
+        if source is None:
+            from sources import LocalSource
+            source = LocalSource(path)
+        self.source = source
+        self.count = 0
+        self.done = threading.Event()
+
+    def files(self):
+        return self.source.iter_files(self.extensions, self.index_path,
+                                      self.workers, self.visited,
+                                      self.known)
+
+    def run(self):
+        logger.info("Scanning " + self.path)
+        try:
+            for filename in self.files():
+                self.callback(filename)
+                self.count += 1
+            if self.finished is not None:
+                self.finished()
+        except ScanError as e:
+            logger.error("Scan of {} failed: {}".format(self.path, e))
+            if self.failed is not None:
+                self.failed(e)
+        except Exception as e:
+            logger.exception(e)
+        finally:
+            logger.info("Found {} Images in {}".format(self.count,
+                                                       self.path))
+            self.done.set()
@@ -0,0 +1,94 @@
+import os.path
+import threading
+import time
+
+from logger import create_logger
+from stats import stats
+logger = create_logger(__name__)
+
+
+class Scheduler:
+    """
+    Deadlines of the automatic transitions
+
+    Deadlines follow each other at exactly interval seconds, no matter how
+    long a slide took to load. The decode time is tracked as an EWMA per
+    directory, so loading of the next slide can start lead_time() seconds
+    before its deadline. Transitions that land more than TOLERANCE seconds
+    late are counted as missed.
+    """
+
+    # weight of the newest decode time
+    ALPHA = 0.25
+    # head start relative to the expected decode time
+    MARGIN = 1.5
+    # expected decode time before anything was measured
+    DEFAULT = 1.0
+    TOLERANCE = 0.05
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.deadline = None
+        self.due = None
+        self._expected = dict()
+        self._overall = None
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """Start counting the interval from now, e.g. after a key press"""
+        self.deadline = time.perf_counter() + self.interval
+        self.due = None
+
+    def advance(self):
+        """The deadline was reached, the next one follows an interval later"""
+        self.due = self.deadline
+        self.deadline += self.interval
+        now = time.perf_counter()
+        if self.deadline < now:
+            # more than a whole interval behind, do not try to catch up
+            logger.warning("Slideshow is %.3f s behind, skipping deadlines",
+                           now - self.deadline)
+            self.deadline = now + self.interval
+
+    def remaining(self):
+        """Return the seconds until the next deadline"""
+        return max(0.0, self.deadline - time.perf_counter())
+
+    def landed(self, expected=0.0):
+        """
+        Record a transition that is completely on screen
+
+        expected is how long after its deadline it is meant to land, e.g.
+        the duration of a crossfade that starts at the deadline.
+        """
+        if self.due is None:
+            return
+        late = time.perf_counter() - self.due - expected
+        self.due = None
+        stats.add("deadline_lateness", max(0.0, late))
+        if late > self.TOLERANCE:
+            logger.info("Missed deadline by %.3f s", late)
+            stats.count("deadlines_missed")
+        else:
+            stats.count("deadlines_met")
+
+    def observe(self, path, seconds):
+        """Update the expected decode time of the directory of path"""
+        d = os.path.dirname(path)
+        with self._lock:
+            old = self._expected.get(d, self._overall)
+            self._expected[d] = seconds if old is None else \
+                old + self.ALPHA * (seconds - old)
+            self._overall = seconds if self._overall is None else \
+                self._overall + self.ALPHA * (seconds - self._overall)
+
+    def expected(self, path):
+        """Return the expected decode time of path"""
+        with self._lock:
+            expected = self._expected.get(os.path.dirname(path),
+                                          self._overall)
+        return self.DEFAULT if expected is None else expected
+
+    def lead_time(self, path):
+        """Return how long before its deadline path should start loading"""
+        return min(self.interval, self.expected(path) * self.MARGIN)
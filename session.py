@@ -0,0 +1,90 @@
+import mmap
+import os
+import os.path
+import struct
+
+from logger import create_logger
+logger = create_logger(__name__)
+
+MAGIC = b"BSSN"
+VERSION = 1
+# magic, version, maxlen, start, size, cursor, seed, cycle cursor, cycle n
+HEADER = struct.Struct("<4sIIIIIQQQ")
+SLOT = struct.Struct("<q")
+NO_CYCLE = 0xFFFFFFFFFFFFFFFF
+
+
+class Session:
+    """
+    History and shuffle position of a Slideshow, kept in a mapped file
+
+    The file mirrors the History ring buffer slot by slot, so a transition
+    only writes the header and the newest slot instead of the whole file.
+    The indices refer to the PathTable saved by the Library.
+    """
+
+    def __init__(self, filename, maxlen):
+        self.filename = filename
+        self.maxlen = maxlen
+        size = HEADER.size + maxlen * SLOT.size
+
+        mode = "r+b" if os.path.exists(filename) else "w+b"
+        self._file = open(filename, mode)
+        if os.path.getsize(filename) != size:
+            self._file.truncate(0)
+            self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), size)
+
+    def close(self):
+        self._map.flush()
+        self._map.close()
+        self._file.close()
+
+    def load(self):
+        """Return the saved state as dict or None"""
+        try:
+            magic, version, maxlen, start, size, cursor, seed, \
+                cycle_cursor, cycle_n = HEADER.unpack_from(self._map)
+        except struct.error:
+            return None
+        if magic != MAGIC or version != VERSION or maxlen != self.maxlen or \
+                size > maxlen:
+            return None
+
+        history = list()
+        for i in range(size):
+            slot = HEADER.size + ((start + i) % maxlen) * SLOT.size
+            history.append(SLOT.unpack_from(self._map, slot)[0])
+
+        cycle = None
+        if cycle_n != NO_CYCLE:
+            cycle = {"seed": seed, "cursor": cycle_cursor, "n": cycle_n}
+        return {"history": history, "cursor": cursor, "cycle": cycle}
+
+    def record(self, history, image_list):
+        """Save the newest History entry, the cursor and the cycle"""
+        buffer, start, size = history.ring()
+        if size:
+            newest = (start + size - 1) % self.maxlen
+            SLOT.pack_into(self._map, HEADER.size + newest * SLOT.size,
+                           buffer[newest])
+        self._write_header(history, image_list)
+        self._map.flush()
+
+    def sync(self, history, image_list):
+        """Save the whole History, e.g. after it was restored or pruned"""
+        buffer, _, _ = history.ring()
+        for i in range(self.maxlen):
+            SLOT.pack_into(self._map, HEADER.size + i * SLOT.size, buffer[i])
+        self._write_header(history, image_list)
+        self._map.flush()
+
+    def _write_header(self, history, image_list):
+        _, start, size = history.ring()
+        seed, cycle_cursor, cycle_n = 0, 0, NO_CYCLE
+        if hasattr(image_list, "state"):
+            cycle = image_list.state()
+            seed, cycle_cursor, cycle_n = \
+                cycle["seed"], cycle["cursor"], cycle["n"]
+        HEADER.pack_into(self._map, 0, MAGIC, VERSION, self.maxlen, start,
+                         size, history.cursor, seed, cycle_cursor, cycle_n)
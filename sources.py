@@ -0,0 +1,362 @@
+import hashlib
+import http.client
+import os
+import os.path
+import queue
+import re
+import threading
+import xml.etree.ElementTree as ElementTree
+from base64 import b64encode
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from io import BytesIO
+from urllib.parse import quote, unquote, urljoin, urlsplit
+
+from logger import create_logger
+from rendercache import DiskCache
+from util import LRUCache, ScanError, contains, iter_files, walk
+logger = create_logger(__name__)
+
+SourceStat = namedtuple("SourceStat", ["st_size", "st_mtime_ns"])
+
+PROPFIND = (b'<?xml version="1.0" encoding="utf-8"?>'
+            b'<propfind xmlns="DAV:"><prop>'
+            b'<resourcetype/><getcontentlength/><getlastmodified/>'
+            b'</prop></propfind>')
+DAV = "{DAV:}"
+HREF = re.compile(r'href="([^"]+)"', re.IGNORECASE)
+
+
+class LocalSource:
+    """Images on a locally mounted filesystem"""
+
+    remote = False
+
+    def __init__(self, path):
+        self.path = path
+
+    def iter_files(self, extensions, index_path=None, workers=1,
+                   visited=None, known=()):
+        if index_path:
+            from index import FileIndex
+            with FileIndex(index_path) as index:
+                yield from index.iter_files(self.path, extensions, workers,
+                                            visited, known)
+        else:
+            yield from iter_files(self.path, extensions, workers, visited,
+                                  known)
+
+    def open(self, path):
+        return open(path, "rb")
+
+    def stat(self, path):
+        return os.stat(path)
+
+
+class ByteCache(DiskCache):
+    """Read-through cache of the raw bytes of remote files"""
+
+    def key(self, path, st):
+        raw = "\0".join(str(x) for x in (path, st.st_size, st.st_mtime_ns))
+        return hashlib.sha1(raw.encode("utf-8", "surrogateescape")).hexdigest()
+
+    def get(self, key):
+        filename = self._open(key)
+        if filename is None:
+            return None
+        try:
+            with open(filename, "rb") as f:
+                return f.read()
+        except OSError:
+            self._remove(key)
+            return None
+
+    def put(self, key, data):
+        def write(filename):
+            with open(filename, "wb") as f:
+                f.write(data)
+        self._write(key, write)
+
+
+class ConnectionPool:
+    """
+    Keep-alive connections to one server
+
+    At most size requests are in flight at once, idle connections are
+    reused as long as they are open. http.client reconnects a connection
+    the server has closed since.
+    """
+
+    def __init__(self, scheme, host, port=None, size=4, timeout=30):
+        if scheme == "https":
+            self._connect = lambda: http.client.HTTPSConnection(
+                host, port, timeout=timeout)
+        else:
+            self._connect = lambda: http.client.HTTPConnection(
+                host, port, timeout=timeout)
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def connection(self):
+        with self._slots:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            try:
+                yield conn
+            except BaseException:
+                conn.close()
+                raise
+            # a connection closed by either side is not worth keeping
+            if conn.sock is not None:
+                self._idle.put(conn)
+
+    def request(self, method, target, headers=None, body=None):
+        """Return (status, headers, body), a stale connection is retried"""
+        for attempt in range(2):
+            with self.connection() as conn:
+                try:
+                    conn.request(method, target, body, headers or dict())
+                    response = conn.getresponse()
+                    return response.status, response.msg, response.read()
+                except (http.client.RemoteDisconnected, ConnectionResetError,
+                        BrokenPipeError):
+                    conn.close()
+                    if attempt:
+                        raise
+
+
+class HTTPSource:
+    """
+    Images on a WebDAV server or behind plain HTTP directory listings
+
+    Directories are listed with PROPFIND, servers without WebDAV like
+    http.server are read from their HTML index pages. Files are fetched
+    over pooled keep-alive connections, large ones as concurrent ranges,
+    and kept in a read-through ByteCache if one is given. Sizes and mtimes
+    from the listings are kept for the STATS most recently used files.
+    Paths are URLs without credentials and percent-encoding.
+    """
+
+    remote = True
+    # size of a range request
+    CHUNK = 1024 * 1024
+    # sizes and mtimes kept from the listings
+    STATS = 16 * 1024
+
+    def __init__(self, url, cache=None, connections=4):
+        parts = urlsplit(url)
+        netloc = parts.hostname
+        if parts.port:
+            netloc += ":{}".format(parts.port)
+        self.base = "{}://{}".format(parts.scheme, netloc)
+        self.path = self.base + unquote(parts.path).rstrip("/")
+        self.cache = cache
+        self.pool = ConnectionPool(parts.scheme, parts.hostname, parts.port,
+                                   connections)
+        self.headers = dict()
+        if parts.username:
+            credentials = "{}:{}".format(unquote(parts.username),
+                                         unquote(parts.password or ""))
+            self.headers["Authorization"] = "Basic " + b64encode(
+                credentials.encode("utf-8")).decode("ascii")
+        self._stats = LRUCache(self.STATS, lambda st: 1)
+        self._stats_lock = threading.Lock()
+        self._webdav = None
+        self._ranges = ThreadPoolExecutor(max_workers=connections,
+                                          thread_name_prefix="Fetch")
+
+    def target(self, path):
+        """Return the request target of a path"""
+        return quote(path[len(self.base):] or "/")
+
+    def request(self, method, path, headers=None, body=None):
+        return self.pool.request(method, self.target(path),
+                                 dict(self.headers, **(headers or dict())),
+                                 body)
+
+    def iter_files(self, extensions, index_path=None, workers=1,
+                   visited=None, known=()):
+        def visit(d):
+            return self.list_dir(d, d == self.path or contains(d, known))
+
+        for d, files in walk(self.path, visit, workers):
+            if visited is not None:
+                visited(d)
+            for filename in files:
+                _, ext = os.path.splitext(filename)
+                if ext.lower() in extensions:
+                    yield filename
+
+    def list_dir(self, path, strict=False):
+        """
+        Return the visible files and subdirectories of path
+
+        A directory that cannot be listed is empty, unless strict is set
+        and ScanError is raised.
+        """
+        try:
+            if self._webdav is not False:
+                status, _, body = self.request(
+                    "PROPFIND", path + "/",
+                    {"Depth": "1", "Content-Type": "application/xml"},
+                    PROPFIND)
+                if status == 207:
+                    self._webdav = True
+                    return self._parse_multistatus(path, body)
+                if self._webdav is None and status in (400, 405, 501):
+                    logger.info("%s does not speak WebDAV, reading the "
+                                "HTML listings", self.base)
+                    self._webdav = False
+                else:
+                    raise OSError("PROPFIND returned {}".format(status))
+
+            status, _, body = self.request("GET", path + "/")
+            if status != 200:
+                raise OSError("GET returned {}".format(status))
+            return self._parse_index(path, body.decode("utf-8", "replace"))
+        except (OSError, http.client.HTTPException,
+                ElementTree.ParseError) as e:
+            if strict:
+                raise ScanError("Cannot list {}: {}".format(path, e)) from e
+            logger.warning("Cannot list {}: {}".format(path, e))
+            return list(), list()
+
+    def _entry(self, path, href):
+        """Return the path of href if it is a visible child of path"""
+        url = urlsplit(urljoin(self.base + quote(path[len(self.base):]) +
+                               "/", href))
+        if url.query or url.fragment or \
+                "{}://{}".format(url.scheme, url.netloc) != self.base:
+            return None
+        child = self.base + unquote(url.path).rstrip("/")
+        parent, name = child.rsplit("/", 1)
+        if parent != path or not name or name.startswith("."):
+            return None
+        return child
+
+    def _parse_multistatus(self, path, body):
+        files = list()
+        subdirs = list()
+        for response in ElementTree.fromstring(body).iter(DAV + "response"):
+            child = self._entry(path, response.findtext(DAV + "href", ""))
+            if child is None:
+                continue
+            if response.find(".//" + DAV + "collection") is not None:
+                subdirs.append(child)
+                continue
+            size = response.findtext(".//" + DAV + "getcontentlength")
+            modified = response.findtext(".//" + DAV + "getlastmodified")
+            if size and modified:
+                with self._stats_lock:
+                    self._stats.put(child, SourceStat(int(size),
+                                                      parse_mtime(modified)))
+            files.append(child)
+        return files, subdirs
+
+    def _parse_index(self, path, html):
+        files = list()
+        subdirs = list()
+        for href in HREF.findall(html):
+            child = self._entry(path, href)
+            if child is None or child in files or child in subdirs:
+                continue
+            if href.endswith("/"):
+                subdirs.append(child)
+            else:
+                # the listing has no sizes, ask again after a rescan
+                with self._stats_lock:
+                    self._stats.pop(child)
+                files.append(child)
+        return files, subdirs
+
+    def stat(self, path):
+        """Return the size and mtime of path, from the listing if known"""
+        with self._stats_lock:
+            st = self._stats.get(path)
+        if st is not None:
+            return st
+        status, headers, _ = self.request("HEAD", path)
+        if status == 404:
+            raise FileNotFoundError(path)
+        if status != 200:
+            raise OSError("HEAD {} returned {}".format(path, status))
+        modified = headers.get("Last-Modified")
+        st = SourceStat(int(headers.get("Content-Length") or 0),
+                        parse_mtime(modified) if modified else 0)
+        with self._stats_lock:
+            self._stats.put(path, st)
+        return st
+
+    def open(self, path):
+        return BytesIO(self.fetch(path))
+
+    def fetch(self, path):
+        """Return the content of path, from the cache if possible"""
+        st = self.stat(path)
+        if self.cache is not None:
+            key = self.cache.key(path, st)
+            data = self.cache.get(key)
+            if data is not None:
+                return data
+
+        data = self._download(path, st.st_size)
+        if self.cache is not None:
+            self.cache.put(key, data)
+        return data
+
+    def _download(self, path, size):
+        if size <= self.CHUNK:
+            return self._get(path)[1]
+
+        # the first range tells whether the server supports ranges at all
+        ranges = [(start, min(start + self.CHUNK, size) - 1)
+                  for start in range(0, size, self.CHUNK)]
+        status, data = self._get(path, ranges[0])
+        if status == 200:
+            return data
+        futures = [self._ranges.submit(self._get, path, r)
+                   for r in ranges[1:]]
+        data = bytearray(data)
+        for future in futures:
+            data += future.result()[1]
+        if len(data) != size:
+            raise OSError("Got {} of {} bytes of {}".format(len(data), size,
+                                                            path))
+        return bytes(data)
+
+    def _get(self, path, byte_range=None):
+        headers = dict()
+        if byte_range is not None:
+            headers["Range"] = "bytes={}-{}".format(*byte_range)
+        status, _, data = self.request("GET", path, headers)
+        if status == 404:
+            raise FileNotFoundError(path)
+        if status not in (200, 206) or \
+                (byte_range is not None and status == 200 and
+                 byte_range[0] > 0):
+            raise OSError("GET {} returned {}".format(path, status))
+        return status, data
+
+
+def parse_mtime(http_date):
+    """Return an HTTP date as nanoseconds since the epoch"""
+    try:
+        return int(parsedate_to_datetime(http_date).timestamp()) * 10 ** 9
+    except (TypeError, ValueError):
+        return 0
+
+
+def create_source(config):
+    """Create the source of ScreenConfig.image_path"""
+    if urlsplit(config.image_path).scheme not in ("http", "https"):
+        return LocalSource(config.image_path)
+
+    cache = None
+    if config.source_cache_path:
+        cache = ByteCache(config.source_cache_path, config.source_cache_size)
+    return HTTPSource(config.image_path, cache, config.source_connections)
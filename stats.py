@@ -0,0 +1,202 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from logger import create_logger
+logger = create_logger(__name__)
+
+
+class Histogram:
+    """Rolling window of the last samples of a duration"""
+
+    def __init__(self, size=512):
+        self._samples = deque(maxlen=size)
+        self.count = 0
+
+    def add(self, value):
+        self._samples.append(value)
+        self.count += 1
+
+    def summary(self):
+        samples = sorted(self._samples)
+        if not samples:
+            return {"count": self.count}
+        return {
+            "count": self.count,
+            "p50": samples[len(samples) // 2],
+            "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+            "max": samples[-1],
+        }
+
+
+class Stats:
+    """
+    Collect timing spans, counters and gauges
+
+    Gauges are callables that are evaluated when a snapshot is taken, so
+    e.g. cache hit rates or scan progress cost nothing until requested.
+    """
+
+    def __init__(self):
+        self._histograms = dict()
+        self._counters = dict()
+        self._gauges = dict()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, value):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.add(value)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def gauge(self, name, fn):
+        with self._lock:
+            self._gauges[name] = fn
+
+    def snapshot(self):
+        with self._lock:
+            spans = {k: v.summary() for k, v in self._histograms.items()}
+            counters = dict(self._counters)
+            gauges = list(self._gauges.items())
+        values = dict()
+        for name, fn in gauges:
+            try:
+                values[name] = fn()
+            except Exception as e:
+                values[name] = str(e)
+        return {"spans": spans, "counters": counters, "gauges": values}
+
+    def summary_line(self):
+        snapshot = self.snapshot()
+        parts = list()
+        for name, s in sorted(snapshot["spans"].items()):
+            if "p50" in s:
+                parts.append("{}={:.0f}/{:.0f}/{:.0f}ms".format(
+                    name, s["p50"] * 1000, s["p95"] * 1000, s["max"] * 1000))
+        for name, value in sorted(snapshot["counters"].items()):
+            parts.append("{}={}".format(name, value))
+        for name, value in sorted(snapshot["gauges"].items()):
+            parts.append("{}={}".format(name, value))
+        return " ".join(parts)
+
+
+stats = Stats()
+
+
+def process_age():
+    """Return the seconds since the process was started, 0 if unknown"""
+    try:
+        with open("/proc/self/stat") as f:
+            # the command may contain spaces, the fields after it do not
+            fields = f.read().rsplit(")", 1)[1].split()
+        started = int(fields[19]) / os.sysconf("SC_CLK_TCK")
+        return max(0.0, time.clock_gettime(time.CLOCK_BOOTTIME) - started)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return 0.0
+
+
+class Startup:
+    """
+    Time from process start to the first slide
+
+    Every phase is marked once with the seconds since the process was
+    started, including the interpreter startup where the platform tells.
+    The marks are logged together after the first paint and published as
+    startup_<phase> gauges.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter() - process_age()
+        self.marks = dict()
+        self._lock = threading.Lock()
+
+    def mark(self, name):
+        if name in self.marks:
+            return
+        with self._lock:
+            if name in self.marks:
+                return
+            elapsed = time.perf_counter() - self.start
+            self.marks[name] = elapsed
+        stats.gauge("startup_" + name, lambda: round(elapsed, 3))
+        if name == "paint":
+            logger.info("Startup: " + self.summary_line())
+
+    def summary_line(self):
+        marks = sorted(self.marks.items(), key=lambda mark: mark[1])
+        return " ".join("{}={:.3f}s".format(name, elapsed)
+                        for name, elapsed in marks)
+
+
+startup = Startup()
+
+
+def hit_rate(hits, misses):
+    total = hits + misses
+    return round(hits / total, 3) if total else None
+
+
+def start_server(host, port):
+    """Serve the stats as JSON on http://host:port/stats"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class StatsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in ("/", "/stats"):
+                self.send_error(404)
+                return
+            body = json.dumps(stats.snapshot()).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug("Stats request: " + format % args)
+
+    server = ThreadingHTTPServer((host, port), StatsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="Stats",
+                              daemon=True)
+    thread.start()
+    logger.info("Serving Stats on http://{}:{}/stats".format(
+        host, server.server_address[1]))
+    return server
+
+
+def start_reporter(interval):
+    """Log a summary line every interval seconds"""
+    def report():
+        while True:
+            time.sleep(interval)
+            logger.info("Stats: " + stats.summary_line())
+
+    thread = threading.Thread(target=report, name="StatsReporter",
+                              daemon=True)
+    thread.start()
+    return thread
+
+
+def start(config):
+    """Start the endpoint and reporter described by a StatsConfig"""
+    if config.port:
+        start_server(config.host, config.port)
+    if config.log_interval:
+        start_reporter(config.log_interval)
@@ -0,0 +1,111 @@
+import os
+import os.path
+import shutil
+
+import pytest
+
+from index import FileIndex
+
+EXTENSIONS = [".jpg", ".png"]
+
+
+def touch(path, data=b"x"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def bump(path):
+    """Move the mtime of path forward, timestamps may be coarse"""
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+
+@pytest.fixture
+def tree(tmp_path):
+    root = str(tmp_path / "images")
+    touch(os.path.join(root, "a.jpg"))
+    touch(os.path.join(root, "sub", "b.png"))
+    touch(os.path.join(root, "sub", "notes.txt"))
+    touch(os.path.join(root, ".hidden", "c.jpg"))
+    return root
+
+
+def sizes(index):
+    return {path: size for path, size, _ in index.files()}
+
+
+def test_round_trip(tree, tmp_path):
+    a = os.path.join(tree, "a.jpg")
+    b = os.path.join(tree, "sub", "b.png")
+    e = os.path.join(tree, "sub", "e.jpg")
+
+    with FileIndex(str(tmp_path / "index.db")) as index:
+        assert sorted(index.scan(tree, EXTENSIONS)) == [a, b]
+
+        touch(e)
+        bump(os.path.join(tree, "sub"))
+        assert sorted(index.scan(tree, EXTENSIONS)) == [a, b, e]
+
+        # a rewritten file keeps the mtime of its directory
+        touch(a, b"longer")
+        index.add_file(a)
+        assert sizes(index)[a] == 6
+
+        os.remove(b)
+        bump(os.path.join(tree, "sub"))
+        assert sorted(index.scan(tree, EXTENSIONS)) == [a, e]
+        assert b not in sizes(index)
+
+        shutil.rmtree(os.path.join(tree, "sub"))
+        bump(tree)
+        assert index.scan(tree, EXTENSIONS) == [a]
+        assert set(sizes(index)) == {a}
+
+
+def test_listing_refreshes_sizes(tree, tmp_path):
+    a = os.path.join(tree, "a.jpg")
+    with FileIndex(str(tmp_path / "index.db")) as index:
+        index.scan(tree, EXTENSIONS)
+        touch(a, b"longer")
+        bump(tree)
+        index.scan(tree, EXTENSIONS)
+        assert sizes(index)[a] == 6
+
+
+def test_unchanged_directories_are_not_listed(tree, tmp_path, monkeypatch):
+    filename = str(tmp_path / "index.db")
+    with FileIndex(filename) as index:
+        expected = index.scan(tree, EXTENSIONS)
+
+    def fail(self, path):
+        raise AssertionError("listed " + path)
+
+    monkeypatch.setattr(FileIndex, "_list", fail)
+    with FileIndex(filename) as index:
+        assert index.scan(tree, EXTENSIONS, workers=4) == expected
+
+
+def test_remove_path(tree, tmp_path):
+    with FileIndex(str(tmp_path / "index.db")) as index:
+        index.scan(tree, EXTENSIONS)
+        index.remove_path(os.path.join(tree, "sub"))
+        assert set(sizes(index)) == {os.path.join(tree, "a.jpg")}
+
+
+def test_writes_during_a_walk_do_not_wait(tree, tmp_path):
+    filename = str(tmp_path / "index.db")
+    with FileIndex(filename) as index:
+        index.scan(tree, EXTENSIONS)
+    bump(tree)
+    bump(os.path.join(tree, "sub"))
+
+    new = os.path.join(tree, "sub", "new.jpg")
+    with FileIndex(filename) as index, FileIndex(filename) as watcher:
+        walker = index.iter_files(tree, EXTENSIONS)
+        next(walker)
+        touch(new)
+        watcher._db.execute("PRAGMA busy_timeout = 100")
+        watcher.add_file(new)
+        assert new in sizes(watcher)
+        list(walker)
@@ -0,0 +1,95 @@
+import os
+import os.path
+import threading
+
+import pytest
+
+from config import ScreenConfig
+from index import FileIndex
+from library import Library
+
+
+def touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"x")
+
+
+@pytest.fixture(params=[False, True], ids=["walk", "index"])
+def config(request, tmp_path):
+    root = str(tmp_path / "images")
+    touch(os.path.join(root, "a.jpg"))
+    touch(os.path.join(root, "sub", "b.jpg"))
+    touch(os.path.join(root, "sub", "deeper", "c.png"))
+    return ScreenConfig({
+        "image_path": root,
+        "index_path": str(tmp_path / "index.db") if request.param else None,
+        "library_path": str(tmp_path / "library"),
+        "quarantine_path": None,
+        "scan_workers": 2,
+        "watch": False,
+        "verify": False,
+    })
+
+
+def start(config, retry=3600):
+    library = Library(config)
+    library.RETRY = retry
+    events = {"added": [], "removed": [], "scanned": threading.Event()}
+    library.subscribe(events["added"].append, events["removed"].append,
+                      events["scanned"].set)
+    library.load()
+    library.start()
+    library.scanner.done.wait(5)
+    return library, events
+
+
+def paths(library):
+    return sorted(library.paths[i] for i in library.paths.indices())
+
+
+def indexed(config):
+    with FileIndex(config.index_path) as index:
+        return sorted(index.files())
+
+
+def test_missing_root_keeps_library(config, tmp_path):
+    library, _ = start(config)
+    expected = paths(library)
+    assert len(expected) == 3
+    rows = indexed(config) if config.index_path else None
+
+    os.rename(config.image_path, str(tmp_path / "unmounted"))
+    library, events = start(config)
+    assert library.restored
+    assert events["removed"] == []
+    assert not events["scanned"].is_set()
+    assert paths(library) == expected
+    if config.index_path:
+        assert indexed(config) == rows
+
+    # the saved table was not replaced either
+    library, _ = start(config)
+    assert paths(library) == expected
+
+
+def test_failed_scan_is_retried(config, tmp_path):
+    start(config)
+    os.rename(config.image_path, str(tmp_path / "unmounted"))
+    library, events = start(config, retry=0.1)
+
+    os.rename(str(tmp_path / "unmounted"), config.image_path)
+    os.remove(os.path.join(config.image_path, "a.jpg"))
+    assert events["scanned"].wait(5)
+    assert events["removed"] == [0]
+    assert paths(library) == [
+        os.path.join(config.image_path, "sub", "b.jpg"),
+        os.path.join(config.image_path, "sub", "deeper", "c.png")]
+
+
+def test_reachable(config, tmp_path):
+    library = Library(config)
+    path = os.path.join(config.image_path, "sub", "b.jpg")
+    assert library.reachable(path)
+    os.rename(config.image_path, str(tmp_path / "unmounted"))
+    assert not library.reachable(path)
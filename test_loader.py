@@ -0,0 +1,25 @@
+import threading
+
+from loader import DecodeBudget
+
+
+def test_decodes_share_the_budget():
+    budget = DecodeBudget()
+    started = threading.Event()
+
+    def decode():
+        with budget.reserve((100, 100), "RGB", max_bytes=60000):
+            started.set()
+
+    with budget.reserve((100, 100), "RGB", max_bytes=60000):
+        assert budget.bytes == 40000
+        worker = threading.Thread(target=decode)
+        worker.start()
+        # both decodes together would exceed max_bytes
+        assert not started.wait(0.1)
+        # a small one still fits next to the first
+        with budget.reserve((10, 10), "L", max_bytes=60000):
+            assert budget.bytes == 40100
+    assert started.wait(5)
+    worker.join()
+    assert budget.bytes == budget.pixels == 0
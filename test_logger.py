@@ -0,0 +1,62 @@
+import logging
+import queue
+
+from logger import LazyQueueHandler, RingBufferHandler
+
+
+class ListHandler(logging.Handler):
+    def __init__(self, level=logging.NOTSET):
+        super().__init__(level)
+        self.messages = list()
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def test_queue_handler_snapshots_arguments():
+    records = queue.SimpleQueue()
+    log = logging.getLogger("test_logger.queue")
+    log.propagate = False
+    log.addHandler(LazyQueueHandler(records))
+    try:
+        images = [1, 2]
+        log.warning("Showing %s", images)
+        images.append(3)
+    finally:
+        log.handlers.clear()
+
+    record = records.get_nowait()
+    assert record.getMessage() == "Showing [1, 2]"
+    assert record.args is None
+
+
+def test_ring_buffer_flushes_before_errors():
+    target = ListHandler(logging.INFO)
+    ring = RingBufferHandler([target], capacity=2)
+    for i in range(3):
+        ring.handle(logging.makeLogRecord({"msg": "debug %d", "args": (i,),
+                                           "levelno": logging.DEBUG}))
+    ring.handle(logging.makeLogRecord({"msg": "info",
+                                       "levelno": logging.INFO}))
+    assert target.messages == []
+
+    ring.handle(logging.makeLogRecord({"msg": "error",
+                                       "levelno": logging.ERROR}))
+    assert target.messages == ["debug 1", "debug 2"]
+    ring.handle(logging.makeLogRecord({"msg": "error",
+                                       "levelno": logging.ERROR}))
+    assert target.messages == ["debug 1", "debug 2"]
+
+
+def test_ring_buffer_keeps_only_dropped_records():
+    console = ListHandler(logging.DEBUG)
+    file = ListHandler(logging.INFO)
+    ring = RingBufferHandler([console, file], level=logging.DEBUG)
+    for levelno in (logging.DEBUG, logging.INFO):
+        ring.handle(logging.makeLogRecord({
+            "msg": logging.getLevelName(levelno), "levelno": levelno}))
+
+    ring.handle(logging.makeLogRecord({"msg": "error",
+                                       "levelno": logging.ERROR}))
+    assert console.messages == []
+    assert file.messages == ["DEBUG"]
@@ -0,0 +1,72 @@
+import threading
+import time
+
+from prefetch import Prefetcher
+
+
+def recorder():
+    loaded = list()
+    event = threading.Event()
+
+    def load(key):
+        loaded.append((key, time.perf_counter()))
+        event.set()
+        return key
+
+    return load, loaded, event
+
+
+def test_prefetch_keeps_requested_keys():
+    load, loaded, _ = recorder()
+    prefetcher = Prefetcher(load, workers=1)
+    try:
+        prefetcher.prefetch([1, 2])
+        assert prefetcher.get(1).result(1) == 1
+        assert prefetcher.get(2).result(1) == 2
+        prefetcher.prefetch([2, 3])
+        prefetcher.get(3).result(1)
+        assert sorted(key for key, _ in loaded) == [1, 2, 3]
+        # 1 was dropped and is loaded again
+        prefetcher.get(1).result(1)
+        assert [key for key, _ in loaded].count(1) == 2
+    finally:
+        prefetcher.shutdown()
+
+
+def test_ahead_starts_its_lead_time_before_due():
+    load, loaded, event = recorder()
+    prefetcher = Prefetcher(load, workers=1, lead_time=lambda key: 0.1)
+    try:
+        due = time.perf_counter() + 0.3
+        prefetcher.prefetch([], ahead=7, due=due)
+        assert not event.wait(0.1)
+        assert event.wait(1)
+        key, started = loaded[0]
+        assert key == 7
+        assert started >= due - 0.1
+        assert started < due
+    finally:
+        prefetcher.shutdown()
+
+
+def test_schedule_moves_ahead():
+    load, loaded, event = recorder()
+    prefetcher = Prefetcher(load, workers=1, lead_time=lambda key: 0.0)
+    try:
+        prefetcher.prefetch([], ahead=7, due=time.perf_counter() + 0.1)
+        prefetcher.schedule(time.perf_counter() + 10)
+        assert not event.wait(0.3)
+
+        prefetcher.schedule(time.perf_counter() - 1)
+        assert event.wait(1)
+        assert [key for key, _ in loaded] == [7]
+    finally:
+        prefetcher.shutdown()
+
+
+def test_shutdown_cancels_ahead():
+    load, _, event = recorder()
+    prefetcher = Prefetcher(load, workers=1)
+    prefetcher.prefetch([], ahead=7, due=time.perf_counter() + 0.1)
+    prefetcher.shutdown()
+    assert not event.wait(0.3)
@@ -0,0 +1,56 @@
+import os
+import os.path
+
+from prerender import find_rendition, mirror_path, remove_stale
+
+
+def touch(path, mtime_ns=None):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"x")
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_mirror_path_carries_settings(tmp_path):
+    root = str(tmp_path / "images")
+    output = str(tmp_path / "mirror")
+    assert mirror_path(os.path.join(root, "sub", "a.JPG"), root, output,
+                       ".jpg", "1920x1080-q90") == \
+        os.path.join(output, "sub", "a.1920x1080-q90.jpg")
+    assert mirror_path(os.path.join(root, "b.png"), root, output, ".jpg",
+                       "1920x1080-q90") == \
+        os.path.join(output, "b.png.1920x1080-q90.jpg")
+
+
+def test_rendition_is_stale_with_other_settings(tmp_path):
+    root = str(tmp_path / "images")
+    output = str(tmp_path / "mirror")
+    source = os.path.join(root, "a.jpg")
+    touch(source)
+    mtime = os.stat(source).st_mtime_ns
+    target = os.path.join(output, "a.1920x1080-q90.jpg")
+    touch(target, mtime)
+
+    assert find_rendition(source, root, output, 1920, 1080, 90) == target
+    assert find_rendition(source, root, output, 1920, 1080, 80) is None
+    assert find_rendition(source, root, output, 1280, 720, 90) is None
+    assert find_rendition(source, root, output, 1920, 1080, 90,
+                          upscale=True) is None
+    touch(source, mtime + 10 ** 9)
+    assert find_rendition(source, root, output, 1920, 1080, 90) is None
+
+
+def test_remove_stale_removes_temporary_files(tmp_path):
+    output = str(tmp_path / "mirror")
+    keep = os.path.join(output, "a.1920x1080-q90.jpg")
+    old = os.path.join(output, "a.1280x720-q90.jpg")
+    tmp = os.path.join(output, "sub", "b.1920x1080.png.1234.tmp")
+    for path in (keep, old, tmp):
+        touch(path)
+
+    assert remove_stale(output, {keep}) == 1
+    assert os.path.exists(keep)
+    assert not os.path.exists(old)
+    assert not os.path.exists(tmp)
+    assert not os.path.exists(os.path.join(output, "sub"))
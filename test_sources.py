@@ -0,0 +1,132 @@
+import functools
+import os
+import os.path
+import re
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from sources import ByteCache, HTTPSource
+
+RANGE = re.compile(r"bytes=(\d+)-(\d+)")
+
+
+class RangeHandler(SimpleHTTPRequestHandler):
+    """http.server with single byte ranges and a request log"""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.requests.append(("GET", self.path,
+                                     self.headers.get("Range")))
+        match = RANGE.fullmatch(self.headers.get("Range") or "")
+        path = self.translate_path(self.path)
+        if match is None or not os.path.isfile(path):
+            return super().do_GET()
+        with open(path, "rb") as f:
+            data = f.read()
+        start, end = int(match.group(1)), int(match.group(2))
+        body = data[start:end + 1]
+        self.send_response(206)
+        self.send_header("Content-Range", "bytes {}-{}/{}".format(
+            start, start + len(body) - 1, len(data)))
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.server.requests.append(("HEAD", self.path, None))
+        super().do_HEAD()
+
+    def log_message(self, *args):
+        pass
+
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+@pytest.fixture
+def server(tmp_path):
+    root = str(tmp_path / "www")
+    write(os.path.join(root, "images", "a.jpg"), b"a" * 100)
+    write(os.path.join(root, "images", "sub", "big image.png"),
+          bytes(range(256)) * 20)
+    write(os.path.join(root, "images", "sub", "notes.txt"), b"")
+    write(os.path.join(root, "images", ".hidden", "c.jpg"), b"c")
+
+    httpd = ThreadingHTTPServer(
+        ("127.0.0.1", 0), functools.partial(RangeHandler, directory=root))
+    httpd.requests = list()
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_http_source(server, tmp_path):
+    base = "http://127.0.0.1:{}".format(server.server_address[1])
+    cache = ByteCache(str(tmp_path / "cache"), 1024 * 1024)
+    source = HTTPSource(base + "/images/", cache)
+    source.CHUNK = 1000
+
+    a = base + "/images/a.jpg"
+    big = base + "/images/sub/big image.png"
+    assert sorted(source.iter_files([".jpg", ".png"], workers=2)) == [a, big]
+
+    assert source.stat(a).st_size == 100
+    assert source.stat(a).st_mtime_ns > 0
+    with pytest.raises(FileNotFoundError):
+        source.stat(base + "/images/missing.jpg")
+
+    assert source.fetch(a) == b"a" * 100
+    del server.requests[:]
+    assert source.fetch(big) == bytes(range(256)) * 20
+    ranges = sorted(r for method, _, r in server.requests
+                    if method == "GET")
+    assert ranges == ["bytes=0-999", "bytes=1000-1999", "bytes=2000-2999",
+                      "bytes=3000-3999", "bytes=4000-4999",
+                      "bytes=5000-5119"]
+
+    # the second fetch is served from the ByteCache
+    del server.requests[:]
+    hits = cache.hits
+    assert source.fetch(big) == bytes(range(256)) * 20
+    assert cache.hits == hits + 1
+    assert not [r for r in server.requests if r[0] == "GET"]
+
+
+def test_pool_drops_closed_connections(server):
+    base = "http://127.0.0.1:{}".format(server.server_address[1])
+    source = HTTPSource(base + "/images/", connections=1)
+    source.stat(base + "/images/a.jpg")
+    assert source.pool._idle.qsize() == 1
+
+    with pytest.raises(ZeroDivisionError):
+        with source.pool.connection():
+            1 / 0
+    assert source.pool._idle.qsize() == 0
+
+    # http.server closes the connection after an error response
+    status, _, _ = source.request("PROPFIND", base + "/images/")
+    assert status == 501
+    assert source.pool._idle.qsize() == 0
+    assert source.stat(base + "/images/sub/big image.png").st_size == 5120
+    assert source.pool._idle.qsize() == 1
+
+
+def test_stats_are_bounded(server, monkeypatch):
+    monkeypatch.setattr(HTTPSource, "STATS", 1)
+    base = "http://127.0.0.1:{}".format(server.server_address[1])
+    source = HTTPSource(base + "/images/")
+    source.stat(base + "/images/a.jpg")
+    source.stat(base + "/images/sub/big image.png")
+    assert len(source._stats) == 1
+
+    del server.requests[:]
+    source.stat(base + "/images/a.jpg")
+    assert server.requests == [("HEAD", "/images/a.jpg", None)]
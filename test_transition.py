@@ -0,0 +1,95 @@
+import os
+import time
+
+import pytest
+
+pytest.importorskip("PyQt5.QtWidgets")
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt5.QtCore import Qt  # noqa: E402
+from PyQt5.QtGui import QColor, QImage, QPixmap  # noqa: E402
+from PyQt5.QtWidgets import QApplication, QLabel  # noqa: E402
+
+from stats import stats  # noqa: E402
+from transition import Crossfade  # noqa: E402
+
+WIDTH, HEIGHT = 64, 48
+
+
+@pytest.fixture(scope="module")
+def app():
+    return QApplication.instance() or QApplication([])
+
+
+def slide(color):
+    image = QImage(WIDTH, HEIGHT, QImage.Format_RGB32)
+    image.fill(QColor(color))
+    return QPixmap.fromImage(image), image
+
+
+def fade(app, crossfade, color, timeout=2.0):
+    """Show color and return the seconds until the fade finished"""
+    finished = list()
+    crossfade.finished.connect(lambda: finished.append(time.perf_counter()))
+    start = time.perf_counter()
+    crossfade.show(*slide(color))
+    while not finished and time.perf_counter() - start < timeout:
+        app.processEvents()
+        time.sleep(0.001)
+    crossfade.finished.disconnect()
+    assert finished, "the fade did not finish"
+    return finished[0] - start
+
+
+def dropped():
+    return stats.snapshot()["counters"].get("crossfade_frames_dropped", 0)
+
+
+def test_fade_ends_on_time(app):
+    label = QLabel()
+    crossfade = Crossfade(label, WIDTH, HEIGHT, duration=0.3, fps=30)
+    try:
+        # nothing to fade from, the first slide is on screen at once
+        assert fade(app, crossfade, Qt.black) < 0.05
+        elapsed = fade(app, crossfade, Qt.white)
+        assert 0.3 <= elapsed < 0.3 + 0.1
+        assert crossfade.current().pixel(0, 0) == QColor(Qt.white).rgb()
+    finally:
+        crossfade.shutdown()
+
+
+def test_late_frames_are_dropped(app):
+    class SlowCrossfade(Crossfade):
+        def canvas(self, image):
+            # the worker falls behind before the first frame
+            time.sleep(0.1)
+            return super().canvas(image)
+
+    label = QLabel()
+    crossfade = SlowCrossfade(label, WIDTH, HEIGHT, duration=0.3, fps=30)
+    try:
+        fade(app, crossfade, Qt.black)
+        before = dropped()
+        elapsed = fade(app, crossfade, Qt.white)
+        assert elapsed < 0.3 + 0.1
+        assert dropped() - before > 0
+        assert label.pixmap().toImage().pixel(0, 0) == \
+            QColor(Qt.white).rgb()
+    finally:
+        crossfade.shutdown()
+
+
+def test_slide_label_reports_its_paint(app):
+    from qtslide import SlideLabel
+
+    label = SlideLabel()
+    painted = list()
+    label.painted.connect(painted.append)
+    label.resize(WIDTH, HEIGHT)
+    label.setPixmap(slide(Qt.white)[0])
+    label.show()
+    try:
+        label.repaint()
+        assert painted and painted[-1] >= 0.0
+    finally:
+        label.close()
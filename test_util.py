@@ -0,0 +1,180 @@
+import os
+import os.path
+import time
+
+import pytest
+
+from util import (WALK_AHEAD, History, LazyRandomImageList, PathTable,
+                  RandomImageList, iter_files, list_dir, walk)
+
+
+def table_paths(table):
+    return [table[i] for i in range(len(table))]
+
+
+def test_path_table_dump_load(tmp_path):
+    table = PathTable()
+    paths = [
+        os.path.join("/images", "a.jpg"),
+        os.path.join("/images", "b.jpg"),
+        os.path.join("/images", "sub", "c.png"),
+        os.path.join("/images", "sub", "\udcff.jpg"),
+    ]
+    for path in paths:
+        table.add(path)
+    table.remove(paths[1])
+
+    filename = str(tmp_path / "paths")
+    table.dump(filename)
+    loaded = PathTable()
+    assert loaded.load(filename)
+
+    assert table_paths(loaded) == [paths[0], None, paths[2], paths[3]]
+    assert list(loaded.indices()) == [0, 2, 3]
+    assert loaded.find(paths[2]) == 2
+    assert loaded.find(paths[1]) is None
+    assert loaded.names(os.path.join("/images", "sub")) == {"c.png": 2,
+                                                             "\udcff.jpg": 3}
+    # indices continue after the loaded ones
+    assert loaded.add_new(paths[1]) == 4
+    assert loaded.add_new(paths[0]) is None
+
+
+def test_path_table_rejects_broken_files(tmp_path):
+    table = PathTable()
+    table.add("/images/a.jpg")
+    filename = str(tmp_path / "paths")
+    table.dump(filename)
+    with open(filename, "rb") as f:
+        data = f.read()
+
+    with open(filename, "wb") as f:
+        f.write(data[:-1])
+    assert not PathTable().load(filename)
+
+    with open(filename, "wb") as f:
+        f.write(b"junk" + data[4:])
+    assert not PathTable().load(filename)
+
+    assert not PathTable().load(str(tmp_path / "missing"))
+
+
+def make_tree(root, depth=3, fanout=3):
+    os.makedirs(root, exist_ok=True)
+    for i in range(fanout):
+        with open(os.path.join(root, "{}.jpg".format(i)), "wb"):
+            pass
+        if depth:
+            make_tree(os.path.join(root, "d{}".format(i)), depth - 1, fanout)
+    os.makedirs(os.path.join(root, ".hidden"), exist_ok=True)
+    with open(os.path.join(root, ".hidden", "x.jpg"), "wb"):
+        pass
+
+
+def sorted_visit(d):
+    files, subdirs = list_dir(d)
+    return sorted(os.path.basename(f) for f in files), sorted(subdirs)
+
+
+def test_walk_matches_os_walk(tmp_path):
+    root = str(tmp_path / "images")
+    make_tree(root)
+    expected = list()
+    for d, dirs, files in os.walk(root):
+        dirs[:] = sorted(x for x in dirs if not x.startswith("."))
+        expected.append((d, sorted(f for f in files
+                                   if not f.startswith("."))))
+
+    assert list(walk(root, sorted_visit)) == expected
+    assert list(walk(root, sorted_visit, workers=4)) == expected
+    files = [os.path.join(d, f) for d, names in expected for f in names]
+    assert sorted(iter_files(root, [".jpg"], workers=4)) == sorted(files)
+
+
+def test_walk_stops_early(tmp_path):
+    root = str(tmp_path / "images")
+    make_tree(root, depth=1, fanout=100)
+    visited = list()
+
+    def visit(d):
+        visited.append(d)
+        time.sleep(0.001)
+        return sorted_visit(d)
+
+    walker = walk(root, visit, workers=2)
+    next(walker)
+    next(walker)
+    walker.close()
+    time.sleep(0.05)
+    assert len(visited) <= 2 + 2 * WALK_AHEAD
+
+
+def test_peek_agrees_with_next_while_adding():
+    for image_list in (RandomImageList(range(20)),
+                       LazyRandomImageList(range(20), seed=1),
+                       LazyRandomImageList()):
+        added = 100
+        for _ in range(30):
+            for _ in range(3):
+                image_list.add(added)
+                added += 1
+            peeked = image_list.peek(5)
+            image_list.add(added)
+            added += 1
+            assert peeked == [image_list.next() for _ in range(len(peeked))]
+        if isinstance(image_list, LazyRandomImageList):
+            assert len(peeked) == 5
+
+
+def test_lazy_peek_crosses_cycles():
+    image_list = LazyRandomImageList(range(3), seed=2)
+    peeked = image_list.peek(7)
+    assert len(peeked) == 7
+    assert peeked == [image_list.next() for _ in range(7)]
+    assert sorted(peeked[:3]) == [0, 1, 2]
+
+
+def test_lazy_state_excludes_peeked():
+    image_list = LazyRandomImageList(range(10), seed=3)
+    image_list.next()
+    state = image_list.state()
+    expected = image_list.peek(4)
+
+    restored = LazyRandomImageList(range(10))
+    assert restored.restore(state)
+    assert [restored.next() for _ in range(4)] == expected
+
+
+def test_history_skips():
+    skipped = {2, 4}
+    history = History(maxlen=10, skip=skipped.__contains__)
+    history.restore(range(6), 0)
+
+    assert history.peek(3) == [1, 3, 5]
+    assert [history.next(), history.next(), history.next()] == [1, 3, 5]
+    assert not history.hasNext()
+    assert [history.prev(), history.prev()] == [3, 1]
+
+    # released elements come back without touching the history
+    skipped.clear()
+    assert history.next() == 2
+    assert list(history) == list(range(6))
+
+
+def test_image_lists_skip():
+    skipped = {1, 3}
+    for image_list in (RandomImageList(range(6), skip=skipped.__contains__),
+                       LazyRandomImageList(range(6),
+                                           skip=skipped.__contains__)):
+        peeked = image_list.peek(4)
+        assert sorted(peeked) == [0, 2, 4, 5]
+        drawn = [image_list.next() for _ in range(8)]
+        assert drawn[:4] == peeked
+        assert not skipped.intersection(drawn)
+        # skipped elements are kept
+        assert len(image_list) == 6
+
+        skipped.update(range(6))
+        with pytest.raises(IndexError):
+            image_list.next()
+        skipped.difference_update({0, 2, 4, 5})
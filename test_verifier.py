@@ -0,0 +1,158 @@
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import verifier
+from util import PathTable
+from verifier import Quarantine, Verifier
+
+
+@pytest.fixture
+def paths():
+    table = PathTable()
+    for name in ("a.jpg", "b.jpg", "c.jpg", "d.jpg"):
+        table.add("/images/" + name)
+    return table
+
+
+def test_backoff_doubles(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(verifier.time, "time", lambda: now)
+    quarantine = Quarantine()
+    quarantine.add(1, "/images/b.jpg", OSError("truncated"))
+    assert 1 in quarantine
+    assert quarantine.due() == []
+
+    now += Quarantine.BACKOFF
+    assert quarantine.due() == [1]
+    quarantine.add(1, "/images/b.jpg", OSError("truncated"))
+    now += Quarantine.BACKOFF
+    assert quarantine.due() == []
+    now += Quarantine.BACKOFF
+    assert quarantine.due() == [1]
+
+    for _ in range(20):
+        quarantine.add(1, "/images/b.jpg", OSError("truncated"))
+    assert quarantine._entries["/images/b.jpg"][1] == \
+        now + Quarantine.MAX_BACKOFF
+
+    quarantine.retry(1)
+    assert quarantine.due() == [1]
+    quarantine.release(1)
+    assert 1 not in quarantine
+    assert len(quarantine) == 0
+
+
+def test_expired_backoff_ends_membership(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(verifier.time, "time", lambda: now)
+    quarantine = Quarantine()
+    quarantine.add(1, "/images/b.jpg", OSError("truncated"))
+    assert 1 in quarantine
+
+    # without a Verifier the slideshow tries the image again
+    now += Quarantine.BACKOFF
+    assert 1 not in quarantine
+    assert len(quarantine) == 1
+    quarantine.add(1, "/images/b.jpg", OSError("truncated"))
+    assert 1 in quarantine
+
+
+def test_persistence(tmp_path, paths, monkeypatch):
+    monkeypatch.setattr(Quarantine, "SAVE_DELAY", 3600)
+    filename = str(tmp_path / "quarantine")
+    quarantine = Quarantine(filename)
+    quarantine.add(1, "/images/b.jpg", OSError("truncated"))
+    quarantine.add(3, "/images/d.jpg", OSError("empty"))
+    # the write is left to a timer
+    assert not (tmp_path / "quarantine").exists()
+    quarantine.save()
+    with open(filename) as f:
+        assert set(json.load(f)) == {"/images/b.jpg", "/images/d.jpg"}
+
+    loaded = Quarantine(filename)
+    loaded.load(paths)
+    assert 1 in loaded and 3 in loaded and 0 not in loaded
+    assert len(loaded) == 2
+
+    loaded.discard(1)
+    loaded.save()
+    reloaded = Quarantine(filename)
+    reloaded.load(paths)
+    assert 1 not in reloaded and 3 in reloaded
+
+
+def test_changes_are_saved_later(tmp_path, monkeypatch):
+    monkeypatch.setattr(Quarantine, "SAVE_DELAY", 0.05)
+    quarantine = Quarantine(str(tmp_path / "quarantine"))
+    quarantine.add(1, "/images/b.jpg", OSError("truncated"))
+    deadline = time.time() + 2
+    while not (tmp_path / "quarantine").exists() and time.time() < deadline:
+        time.sleep(0.01)
+    assert (tmp_path / "quarantine").exists()
+
+
+def make_verifier(paths, remote=False, reachable=True):
+    library = SimpleNamespace(paths=paths,
+                              source=SimpleNamespace(remote=remote),
+                              reachable=lambda path: reachable)
+    return Verifier(library, Quarantine(), delay=0)
+
+
+def test_verifier_order(paths):
+    v = make_verifier(paths)
+    v.ahead([2])
+    v.quarantine.add(3, paths[3], OSError("truncated"))
+    v.quarantine.retry(3)
+    # ahead, then the sweep in index order, then the due ones
+    assert [v.next() for _ in range(5)] == [2, 0, 1, 2, 3]
+    assert v.next() == 3
+
+
+def test_verifier_invalidate(paths, monkeypatch):
+    failing = {paths[1]}
+
+    def verify_image(path, *args):
+        if path in failing:
+            raise OSError("truncated")
+
+    monkeypatch.setattr(verifier, "verify_image", verify_image)
+    v = make_verifier(paths)
+    while True:
+        image = v.next()
+        if image is None or v.verified(image) or image in v.quarantine:
+            break
+        v.verify(image, paths[image])
+    assert [v.verified(i) for i in range(4)] == [True, False, True, True]
+    assert 1 in v.quarantine
+
+    v.invalidate(2)
+    assert not v.verified(2)
+    assert v.next() == 2
+    v.verify(2, paths[2])
+    assert v.next() is None
+
+    failing.clear()
+    v.quarantine.retry(1)
+    assert v.next() == 1
+    v.verify(1, paths[1])
+    assert v.verified(1) and 1 not in v.quarantine
+
+
+def test_remote_sources_are_not_swept(paths):
+    v = make_verifier(paths, remote=True)
+    assert v.next() is None
+    v.ahead([2, 1])
+    assert [v.next(), v.next(), v.next()] == [2, 1, None]
+
+
+def test_unreachable_images_are_not_quarantined(paths, monkeypatch):
+    def verify_image(path, *args):
+        raise OSError("Transport endpoint is not connected")
+
+    monkeypatch.setattr(verifier, "verify_image", verify_image)
+    v = make_verifier(paths, reachable=False)
+    v.verify(0, paths[0])
+    assert len(v.quarantine) == 0 and not v.verified(0)
@@ -1,13 +1,19 @@
 #!/usr/bin/env python3
 """Display a slideshow from a list of filenames"""
 
-import random
+import queue
+import time
 import tkinter
 
-from PIL import Image, ImageTk
-
 from config import Config
-from util import get_files
+from library import Library, Unreachable
+from loader import ImageTooLarge, load_image
+from prefetch import Prefetcher
+from rendercache import create_render_cache
+from scheduler import Scheduler
+from session import Session
+from stats import hit_rate, startup, stats
+from util import History, create_image_list
 
 from logger import create_logger
 logger = create_logger(__name__)
@@ -16,42 +22,68 @@ logger = create_logger(__name__)
 class Slideshow(tkinter.Tk):
     """Display a slideshow"""
 
-    allowed_extensions = [".png", ".jpg", ".jpeg"]
-    images = list()
-    history = list()
-    history_pointer = 0
+    image = None
+    session = None
 
     def __init__(self, _config: Config):
         tkinter.Tk.__init__(self)
         logger.debug("Creating Window")
         self.config = _config
 
-        logger.debug("Setting geometry to +0+0")
-        self.geometry("+0+0")
+        geometry = "{}x{}+0+0".format(self.config.screen.width,
+                                      self.config.screen.height)
+        logger.debug("Setting geometry to " + geometry)
+        self.geometry(geometry)
 
-        logger.info("Setting Topmost to " + self.config.slideshow.topmost)
+        logger.info("Setting Topmost to " +
+                    str(self.config.slideshow.topmost))
         self.attributes("-topmost", self.config.slideshow.topmost)
 
         logger.info("Setting Fullscreen to " +
-                    self.config.slideshow.fullscreen)
+                    str(self.config.slideshow.fullscreen))
         self.attributes("-fullscreen", self.config.slideshow.fullscreen)
 
         logger.debug("image_path: " + self.config.screen.image_path)
         self.image_path = self.config.screen.image_path
-        logger.debug("interval: " + self.config.slideshow.interval)
+        logger.debug("interval: " + str(self.config.slideshow.interval))
         self.interval = self.config.slideshow.interval
+        self.scheduler = Scheduler(self.interval)
         logger.debug("max_history_length: " +
-                     self.config.slideshow.history_length)
+                     str(self.config.slideshow.history_length))
         self.max_history_length = self.config.slideshow.history_length
+        self.library = Library(self.config.screen,
+                               self.config.slideshow.max_image_pixels,
+                               self.config.slideshow.max_image_bytes)
+        self.history = History(maxlen=self.max_history_length,
+                               skip=self.library.quarantine.__contains__)
+        self.paths = self.library.paths
+        self.removed_images = queue.Queue()
+        self.decoded_images = queue.Queue()
+
+        logger.debug("Setting up Render Cache")
+        self.render_cache = create_render_cache(self.config.cache)
+        if self.render_cache is not None:
+            stats.gauge("render_cache_hit_rate",
+                        lambda: hit_rate(self.render_cache.hits,
+                                         self.render_cache.misses))
+
+        logger.debug("Setting up Prefetcher")
+        self.prefetcher = Prefetcher(self.decode_image,
+                                     self.config.slideshow.decode_workers,
+                                     lead_time=self.lead_time)
 
         logger.debug("Setting Background to black")
         self.configure(background="black", cursor="none")
 
-        logger.debug("Creating Slide Label")
-        self.slide = tkinter.Label(self)
-        logger.debug("Setting Slide Background to black")
-        self.slide.configure(background="black")
-        self.slide.pack()
+        # the next image is put into the hidden label which is then raised
+        # above the visible one, so the old image stays until the swap
+        logger.debug("Creating Slide Labels")
+        self.slides = list()
+        for _ in range(2):
+            slide = tkinter.Label(self, background="black", borderwidth=0)
+            slide.place(relx=0.5, rely=0.5, anchor=tkinter.CENTER)
+            self.slides.append(slide)
+        self.slide = self.slides[0]
 
         logger.debug("Bind Left")
         self.bind("<Left>", self.on_left)
@@ -69,54 +101,124 @@ class Slideshow(tkinter.Tk):
         self.next_image()
 
     def on_esc(self, event):
+        self.prefetcher.shutdown()
+        self.library.save()
+        if self.session is not None:
+            self.session.close()
         self.quit()
 
     def load_images(self):
         logger.info("Getting all files in {} with allowed".format(self.image_path) +
-                    "endings ({})".format(self.allowed_extensions))
-        self.images = get_files(self.image_path, self.allowed_extensions)
-        self.shuffle_images()
-
-    def shuffle_images(self):
-        logger.info("Shuffeling Images")
-        random.shuffle(self.images)
-
-    def prepare_image_list(self):
-        i = 0
-        while True:
-            if i >= len(self.images):
-                self.shuffle_images()
-                i = 0
-            yield self.images[i]
-            i += 1
-
-    def select_image(self):
-        if not hasattr(self, "image_list"):
-            self.image_list = self.prepare_image_list()
-        return self.image_list.__next__()
+                    "endings ({})".format(self.config.screen.file_types))
+        self.library.load()
+        self.images = create_image_list(self.config.slideshow.shuffle,
+                                        self.library.paths.indices(),
+                                        self.library.quarantine.__contains__)
+        self.library.subscribe(self.images.add, self.remove_image,
+                               getattr(self.images, "settle", None))
+        self.restore_session()
+        self.library.start()
+        self.forget_removed_images()
+        self.show_decoded_images()
+
+    def restore_session(self):
+        if not self.config.slideshow.session_path:
+            return
+        self.session = Session(self.config.slideshow.session_path,
+                               self.max_history_length)
+        state = self.session.load()
+        if state is None or not self.library.restored:
+            return
+
+        logger.info("Restoring Session")
+        self.history.restore([x for x in state["history"]
+                              if 0 <= x < len(self.paths) and
+                              self.paths[x] is not None], state["cursor"])
+        if state["cycle"] and hasattr(self.images, "restore"):
+            if not self.images.restore(state["cycle"]):
+                logger.info("Library changed, starting a new cycle")
+        self.session.sync(self.history, self.images)
+
+    def save_session(self):
+        if self.session is not None:
+            self.session.record(self.history, self.images)
+
+    def wait_for_first_image(self):
+        if self.history.size() > 0 or len(self.images) > 0:
+            startup.mark("scan")
+
+        if self.history.size() > 0:
+            logger.info("Resuming with Image from History")
+            self.set_image(self.history.current())
+            self.reset_timer()
+        elif len(self.images) > 0:
+            self.next_image()
+        elif self.library.scanner.done.is_set():
+            logger.error("Image List is empty")
+            self.quit()
+        else:
+            self.after(100, self.wait_for_first_image)
+
+    def remove_image(self, image):
+        self.images.remove(image)
+        self.removed_images.put(image)
+
+    def skip_image(self, image, remove=True):
+        """
+        Drop an image that cannot be shown and show another one
+
+        A quarantined image stays in the image list, which skips it until
+        its backoff expired.
+        """
+        latest = not self.history.hasNext()
+        if remove:
+            self.images.remove(image)
+        self.history.remove(image)
+        if self.session is not None:
+            self.session.sync(self.history, self.images)
+        if len(self.images) == 0:
+            logger.error("Image List is empty")
+        elif latest or self.history.size() == 0:
+            self.show_next_image()
+        else:
+            self.set_image(self.history.current())
+
+    def forget_removed_images(self):
+        """Drop removed images from the history on the Tk thread"""
+        removed = False
+        while not self.removed_images.empty():
+            self.history.remove(self.removed_images.get())
+            removed = True
+        if removed and self.session is not None:
+            self.session.sync(self.history, self.images)
+        self.after(500, self.forget_removed_images)
 
     def next_image(self):
-        logger.info("Loading next Image")
-
-        # if the history pointer is 0 we're at the top an will load a new image
-        # otherwise we increase the pointer and load the next image
-        if self.history_pointer == 0:
-            self.image_name = self.select_image()
-        else:
-            self.history_pointer -= 1
-            self.image_name = self.history[-self.history_pointer]
+        self.show_next_image()
+        self.reset_timer()
 
-        # add image to history
-        self.history.append(self.image_name)
+    def tick(self):
+        self.scheduler.advance()
+        self.show_next_image()
+        self.schedule_next_image()
 
-        # ensure history is not longer than we want
-        if len(self.history) > self.max_history_length:
-            self.history = self.height[len(self.history) - self.max_history_length:]
+    def show_next_image(self):
+        logger.info("Loading next Image")
 
-        # load the image
-        self.load_image()
+        # walk forward through the history before picking a new image
+        if self.history.hasNext():
+            image = self.history.next()
+        else:
+            try:
+                image = self.images.next()
+            except IndexError as e:
+                # e.g. every image is quarantined, try again on the next tick
+                logger.warning("No Image to show: %s", e)
+                return
+            self.history.push(image)
+        self.save_session()
 
-        self.schedule_next_image()
+        self.set_image(image)
 
     """
     Load the previous image
@@ -126,69 +228,152 @@ class Slideshow(tkinter.Tk):
     def prev_image(self):
         logger.info("Loading previous Image")
 
-        if self.history_pointer >= self.max_history_length:
-            self.history_pointer = self.max_history_length
+        if not self.history.hasPrev():
+            logger.info("Already at oldest available Image")
+            return
 
         # move deeper into the history
-        self.history_pointer += 1
-
-        # an get the image name
-        self.image_name = self.history[-self.history_pointer]
-
-        # and load it
-        self.load_image()
+        image = self.history.prev()
+        self.save_session()
 
-        self.schedule_next_image()
-
-    def load_image(self):
-        logger.info("Loading " + self.image_name)
-
-        # actually load the image from the given path
-        self.image = Image.open(self.image_name)
-
-        logger.debug("Loaded Image Size: {}x{}".format(self.image.width, self.image.height))
-
-        if self.image.width > 1920 or self.image.height > 1080:
-            wscale = 1920 / self.image.width
-            hscale = 1080 / self.image.height
-            if wscale > hscale:
-                scale = hscale
-            else:
-                scale = wscale
-
-            new_width = int(scale * self.image.width)
-            new_height = int(scale * self.image.height)
+        self.set_image(image)
 
-            logger.info("Resizing image to {}x{}".format(new_width, new_height))
+        self.reset_timer()
 
-            self.image = self.image.resize((new_width, new_height),
-                                           Image.LANCZOS)
+    def set_image(self, image):
+        """Show image as soon as a decode worker has loaded it"""
+        logger.info("Loading %s", self.paths[image])
+        self.image = image
+        self.transition_start = time.perf_counter()
 
-        self.image = ImageTk.PhotoImage(self.image)
-
-        # load the image as image of slide
-        self.slide.config(image=self.image)
+        future = self.prefetcher.get(image)
+        if future.done():
+            self.show_image(image, future)
+        else:
+            logger.debug("Waiting for Image to be decoded")
+            future.add_done_callback(
+                lambda f: self.decoded_images.put((image, f)))
+
+        self.prefetch_images()
+
+    def upcoming_images(self, n):
+        upcoming = self.history.peek(n)
+        if len(upcoming) < n:
+            upcoming += self.images.peek(n - len(upcoming))
+        return upcoming
+
+    def prefetch_images(self):
+        prefetch = self.config.slideshow.prefetch
+        upcoming = self.upcoming_images(max(1, prefetch))
+        # without prefetching the next image still starts before its deadline
+        ahead = upcoming[0] if upcoming and not prefetch else None
+        self.prefetcher.prefetch([self.image] + upcoming[:prefetch], ahead,
+                                 self.scheduler.deadline)
+
+        if self.library.verifier is not None:
+            self.library.verifier.ahead(
+                self.upcoming_images(self.library.verifier.AHEAD))
+
+    def lead_time(self, image):
+        """Return how long before its deadline image starts decoding"""
+        path = self.paths[image]
+        return 0 if path is None else self.scheduler.lead_time(path)
+
+    def decode_image(self, image):
+        """Load and scale an image, runs on a decode worker"""
+        path = self.paths[image]
+        start = time.perf_counter()
+        try:
+            image = load_image(
+                path,
+                self.config.screen.width,
+                self.config.screen.height,
+                upscale=False,
+                cache=self.render_cache,
+                max_pixels=self.config.slideshow.max_image_pixels,
+                max_bytes=self.config.slideshow.max_image_bytes,
+                source=self.library.source)
+        except ImageTooLarge:
+            raise
+        except Exception as e:
+            if not self.library.reachable(path):
+                raise Unreachable(str(e)) from e
+            raise
+        self.scheduler.observe(path, time.perf_counter() - start)
+        return image
+
+    def show_decoded_images(self):
+        """Show images finished by the decode workers on the Tk thread"""
+        while not self.decoded_images.empty():
+            self.show_image(*self.decoded_images.get())
+        self.after(20, self.show_decoded_images)
+
+    def show_image(self, image, future):
+        if image != self.image:
+            logger.debug("Image changed while decoding. Skipping.")
+            return
+        if future.cancelled():
+            return
+
+        try:
+            loaded = future.result()
+        except ImageTooLarge as e:
+            logger.warning("Skipping %s: %s", self.paths[image], e)
+            return self.skip_image(image)
+        except Unreachable as e:
+            # keep the slide on screen, the next tick tries another one
+            logger.warning("Cannot load %s: %s", self.paths[image], e)
+            return
+        except Exception as e:
+            logger.warning("Cannot load %s: %s", self.paths[image], e)
+            self.library.quarantine.add(image, self.paths[image], e)
+            return self.skip_image(image, remove=False)
+        self.library.quarantine.release(image)
+        logger.debug("Loaded Image Size: %dx%d", loaded.width, loaded.height)
+
+        from PIL import ImageTk
+
+        with stats.span("to_photoimage"):
+            photo = ImageTk.PhotoImage(loaded)
+
+        # fill the hidden label and raise it before the old image is
+        # released, the label keeps its PhotoImage alive
+        with stats.span("paint"):
+            front = self.slide
+            back = self.slides[1] if front is self.slides[0] \
+                else self.slides[0]
+            back.configure(image=photo)
+            back.photo = photo
+            back.lift()
+            front.configure(image="")
+            front.photo = None
+            self.slide = back
+            # configure only schedules the redraw, draw it to time it
+            self.update_idletasks()
 
         # set the title (could be removed but who cares)
-        self.title(self.image_name)
-
-        # center the slide
-        self.center()
+        self.title(self.paths[image])
 
-    def center(self):
-        """Center the image in the window"""
-        logger.debug("Centering Slide")
+        stats.add("transition", time.perf_counter() - self.transition_start)
+        self.scheduler.landed()
+        startup.mark("paint")
 
-        self.update_idletasks()
-        self.slide.place(relx=0.5, rely=0.5, anchor=tkinter.CENTER)
+    def reset_timer(self):
+        self.scheduler.reset()
+        self.schedule_next_image()
 
     def schedule_next_image(self):
+        """Set the alarm for showing the next image"""
         if hasattr(self, "next_image_alarm"):
-            self.after_cancel(getattr(self, "next_image_alarm"))
-        self.next_image_alarm = self.after(self.interval, self.next_image)
+            self.after_cancel(self.next_image_alarm)
+
+        # after() takes milliseconds
+        remaining = self.scheduler.remaining()
+        self.prefetcher.schedule(self.scheduler.deadline)
+        self.next_image_alarm = self.after(int(remaining * 1000), self.tick)
 
     def start(self):
         """Start method"""
         self.load_images()
-        self.next_image()
+        self.wait_for_first_image()
         self.mainloop()
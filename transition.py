@@ -0,0 +1,163 @@
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt5.QtCore import QObject, Qt, QTimer, pyqtSignal
+from PyQt5.QtGui import QColor, QImage, QPainter, QPixmap
+
+from logger import create_logger
+from stats import stats
+logger = create_logger(__name__)
+
+
+class Crossfade(QObject):
+    """
+    Dissolve from the slide on screen to the next one
+
+    The frames are blended by QPainter on screen-sized QImages on a worker
+    thread of their own, at most AHEAD frames before the one on screen, so
+    the GUI thread only swaps pixmaps and the decode pool keeps decoding.
+    Frames the worker could not deliver in time are dropped, the fade
+    still ends after duration seconds. finished is emitted once the new
+    slide is completely on screen.
+    """
+
+    # frames composed ahead of the one on screen
+    AHEAD = 2
+
+    finished = pyqtSignal()
+
+    def __init__(self, label, width, height, duration=1.0, fps=30):
+        super().__init__(label)
+        self.label = label
+        self.width = width
+        self.height = height
+        self.duration = duration
+        self.fps = fps
+        self.frames = max(1, round(duration * fps))
+        self.timer = QTimer(self)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.timeout.connect(self.tick)
+        self._pool = ThreadPoolExecutor(max_workers=1,
+                                        thread_name_prefix="Transition")
+        self._pixmap = None
+        self._image = None
+        self._frame = None
+        self._frames = None
+        self._next = None
+        self._cancel = None
+        self._start = self._last = 0.0
+        self._shown = 0
+
+    def show(self, pixmap, image):
+        """
+        Fade to pixmap, image is the same picture as QImage
+
+        Both are needed, as a QPixmap can neither be read on the worker
+        nor converted without a copy on the GUI thread.
+        """
+        old = self.current()
+        self.stop()
+        self._pixmap = pixmap
+        self._image = image
+        if old is None:
+            self.label.setPixmap(pixmap)
+            self.finished.emit()
+            return
+
+        new = image
+        self._frames = queue.Queue(maxsize=self.AHEAD)
+        self._next = None
+        self._cancel = threading.Event()
+        self._pool.submit(self.compose, old, new, self._frames, self._cancel)
+        self._start = self._last = time.perf_counter()
+        self._shown = 0
+        self.timer.start(1000 // self.fps)
+
+    def current(self):
+        """Return the QImage on screen or None"""
+        if self._frame is not None:
+            return self._frame
+        return self._image
+
+    def stop(self):
+        """Abort a running fade, the frame on screen stays"""
+        self.timer.stop()
+        if self._cancel is not None:
+            self._cancel.set()
+            self._cancel = None
+            stats.count("crossfade_frames_dropped",
+                        self.frames - 1 - self._shown)
+        self._frame = None
+
+    def shutdown(self):
+        self.stop()
+        self._pool.shutdown(wait=False)
+
+    def tick(self):
+        now = time.perf_counter()
+        due = int((now - self._start) * self.fps)
+        if due >= self.frames:
+            self.stop()
+            self.label.setPixmap(self._pixmap)
+            stats.add("crossfade_frame_time", now - self._last)
+            stats.add("crossfade", now - self._start)
+            self.finished.emit()
+            return
+
+        # take the latest frame that is due, late ones are dropped
+        frame = None
+        while True:
+            if self._next is None:
+                try:
+                    self._next = self._frames.get_nowait()
+                except queue.Empty:
+                    break
+            i, image = self._next
+            if i > due:
+                break
+            frame = image
+            self._next = None
+        if frame is None:
+            return
+
+        self._frame = frame
+        self.label.setPixmap(QPixmap.fromImage(frame))
+        self._shown += 1
+        stats.add("crossfade_frame_time", now - self._last)
+        self._last = now
+
+    def canvas(self, image):
+        """Return image centered on a black screen-sized QImage"""
+        canvas = QImage(self.width, self.height, QImage.Format_RGB32)
+        canvas.fill(QColor(Qt.black))
+        painter = QPainter(canvas)
+        painter.drawImage((self.width - image.width()) // 2,
+                          (self.height - image.height()) // 2, image)
+        painter.end()
+        return canvas
+
+    def compose(self, old, new, frames, cancel):
+        """Blend the frames between old and new, runs on the worker"""
+        try:
+            old = self.canvas(old)
+            new = self.canvas(new)
+            for i in range(1, self.frames):
+                if cancel.is_set():
+                    return
+                with stats.span("crossfade_compose"):
+                    # painting detaches the copy from old
+                    frame = QImage(old)
+                    painter = QPainter(frame)
+                    painter.setOpacity(i / self.frames)
+                    painter.drawImage(0, 0, new)
+                    painter.end()
+                while not cancel.is_set():
+                    try:
+                        frames.put((i, frame), timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+        except Exception:
+            logger.exception("Cannot compose Crossfade")
@@ -1,97 +1,807 @@
-import glob
+import os
 import os.path
 import random
-from PIL import ExifTags
-
-
-def get_files(path, extensions):
-    result = list()
-    path += "/**"
-    for filename in glob.glob(path, recursive=True):
-        _, ext = os.path.splitext(filename)
-        if ext.lower() in extensions:
-            result.append(os.path.normpath(filename))
-    return result
-
-
-def getExif(image):
-    exif = {}
-    info = image._getexif()
-    if info:
-        for tag, value in info.items():
-            decoded = ExifTags.TAGS.get(tag, tag)
-            exif[decoded] = value
-        return exif
+import struct
+import threading
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+ORIENTATION = 0x0112
+# directories visited ahead of a parallel walk per worker
+WALK_AHEAD = 4
+
+
+def get_files(path, extensions, index_path=None, workers=1, strict=False):
+    """
+    Return all files below path with one of the given extensions
+
+    A path that cannot be read has no files, unless strict is set and
+    ScanError is raised.
+    """
+    try:
+        if index_path:
+            from index import FileIndex
+            with FileIndex(index_path) as index:
+                return index.scan(path, extensions, workers)
+        return list(iter_files(path, extensions, workers))
+    except ScanError:
+        if strict:
+            raise
+        return list()
+
+
+class ScanError(OSError):
+    """A directory that held images could not be read, the scan is partial"""
+
+
+def iter_files(path, extensions, workers=1, visited=None, known=()):
+    """
+    Yield all files below path with one of the given extensions
+
+    Hidden files and directories are skipped like glob.glob does. With
+    more than one worker the directories are listed concurrently, the
+    order of the results stays the same. visited(d) is called for every
+    directory of the walk. Raises ScanError if path or a directory in or
+    above one of the known directories cannot be listed, other
+    directories that cannot be listed are treated as empty.
+    """
+    path = os.path.normpath(path)
+
+    def visit(d):
+        return list_dir(d, d == path or contains(d, known))
+
+    for d, files in walk(path, visit, workers):
+        if visited is not None:
+            visited(d)
+        for filename in files:
+            _, ext = os.path.splitext(filename)
+            if ext.lower() in extensions:
+                yield filename
+
+
+def list_dir(path, strict=False):
+    """
+    Return the visible files and subdirectories of path
+
+    A directory that cannot be listed is empty, unless strict is set and
+    ScanError is raised.
+    """
+    files = list()
+    subdirs = list()
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.name.startswith("."):
+                    continue
+                try:
+                    if entry.is_dir():
+                        subdirs.append(os.path.normpath(entry.path))
+                    else:
+                        files.append(os.path.normpath(entry.path))
+                except OSError:
+                    continue
+    except OSError as e:
+        if strict:
+            raise ScanError("Cannot list {}: {}".format(path, e)) from e
+    return files, subdirs
+
+
+def contains(d, dirs):
+    """Return whether d is one of dirs or a parent of one of them"""
+    prefix = os.path.join(d, "")
+    return any(x == d or x.startswith(prefix) for x in dirs)
+
+
+def walk(path, visit, workers=1):
+    """
+    Walk a directory tree in pre-order
+
+    visit(path) has to return (result, subdirs) and is called once for
+    every directory. Yields (path, result). With more than one worker
+    visit is called on a thread pool for the next WALK_AHEAD directories
+    per worker, so high-latency listings overlap while the results are
+    still yielded in pre-order and memory stays bounded. Closing the
+    generator early cancels the visits that have not started yet.
+    """
+    if workers <= 1:
+        result, subdirs = visit(path)
+        yield path, result
+        for subdir in subdirs:
+            yield from walk(subdir, visit)
+        return
+
+    ahead = workers * WALK_AHEAD
+    pool = ThreadPoolExecutor(max_workers=workers,
+                              thread_name_prefix="Walk")
+    # directories still to visit with their futures, the next one last
+    stack = [[path, None]]
+    try:
+        while stack:
+            for entry in reversed(stack[-ahead:]):
+                if entry[1] is None:
+                    entry[1] = pool.submit(visit, entry[0])
+            p, future = stack.pop()
+            result, subdirs = future.result()
+            yield p, result
+            stack.extend([s, None] for s in reversed(subdirs))
+    finally:
+        for _, future in stack:
+            if future is not None:
+                future.cancel()
+        pool.shutdown(wait=False)
+
+
+def read_orientation(exif):
+    """
+    Return the Orientation tag from raw EXIF data or None
+
+    Only walks the entries of the first IFD, all other tags and maker
+    notes are never decoded.
+    """
+    if exif.startswith(b"Exif\0\0"):
+        exif = exif[6:]
+    if exif[:2] == b"II":
+        endian = "<"
+    elif exif[:2] == b"MM":
+        endian = ">"
     else:
         return None
 
+    try:
+        offset, = struct.unpack_from(endian + "I", exif, 4)
+        count, = struct.unpack_from(endian + "H", exif, offset)
+        for i in range(count):
+            entry = offset + 2 + i * 12
+            tag, = struct.unpack_from(endian + "H", exif, entry)
+            if tag == ORIENTATION:
+                value, = struct.unpack_from(endian + "H", exif, entry + 8)
+                return value
+    except struct.error:
+        pass
+    return None
+
 
 class History:
     """
     Simple History List
+
+    Holds integer indices in a fixed size ring buffer, so pushing onto a
+    full History just overwrites the oldest element. Moving the cursor
+    and peek() pass over elements for which skip(x) is true.
     """
 
     cursor = 0
-    _list = list()
 
-    def __init__(self, maxlen):
+    def __init__(self, maxlen, skip=None):
         self.maxlen = maxlen
+        self.skip = skip
+        self._buffer = array("l", bytes(maxlen * array("l").itemsize))
+        self._start = 0
+        self._size = 0
+
+    def __getitem__(self, i):
+        if not 0 <= i < self._size:
+            raise IndexError("History index out of range")
+        return self._buffer[(self._start + i) % self.maxlen]
+
+    def __iter__(self):
+        for i in range(self._size):
+            yield self[i]
 
     def current(self):
-        return self._list[self.cursor]
+        return self[self.cursor]
 
     def next(self):
-        if self.hasNext():
-            self.cursor += 1
+        i = self._step(1)
+        if i is not None:
+            self.cursor = i
             return self.current()
 
     def prev(self):
-        if self.hasPrev():
-            self.cursor -= 1
+        i = self._step(-1)
+        if i is not None:
+            self.cursor = i
             return self.current()
 
     def hasNext(self):
-        return self.cursor < len(self._list) - 1
+        return self._step(1) is not None
+
+    def peek(self, n):
+        """Return up to n elements after the cursor without moving it"""
+        result = list()
+        for i in range(self.cursor + 1, self._size):
+            if self.skip is None or not self.skip(self[i]):
+                result.append(self[i])
+                if len(result) >= n:
+                    break
+        return result
 
     def hasPrev(self):
-        return self.cursor > 0
+        return self._step(-1) is not None
+
+    def _step(self, direction):
+        """Return the position of the next element not skipped or None"""
+        i = self.cursor + direction
+        while 0 <= i < self._size:
+            if self.skip is None or not self.skip(self[i]):
+                return i
+            i += direction
+        return None
 
     def push(self, x):
         """
         Add a new element to the History
 
-        Removes last element if max lenght is reached.
-        Set the pointer to the first element.
+        Overwrites the oldest element if max length is reached.
+        Set the pointer to the newest element.
         """
-        # if the list is at max lenght
-        if len(self._list) >= self.maxlen:
-            # remove the last element
-            self._list.pop(0)
+        if self._size < self.maxlen:
+            self._size += 1
+        else:
+            self._start = (self._start + 1) % self.maxlen
 
-        # add the new element
-        self._list.append(x)
+        self._buffer[(self._start + self._size - 1) % self.maxlen] = x
 
-        # set the pointer to the first element
-        self.cursor = len(self._list) - 1
+        # set the pointer to the newest element
+        self.cursor = self._size - 1
 
     def size(self):
-        return len(self._list)
+        return self._size
+
+    def ring(self):
+        """Return buffer, start and size of the underlying ring buffer"""
+        return self._buffer, self._start, self._size
+
+    def restore(self, items, cursor):
+        """Replace the History with items and move the cursor to cursor"""
+        items = list(items)[-self.maxlen:]
+        self._start = 0
+        self._size = len(items)
+        for i, x in enumerate(items):
+            self._buffer[i] = x
+        self.cursor = max(0, min(cursor, self._size - 1))
+
+    def __contains__(self, x):
+        return any(x == y for y in self)
+
+    def remove(self, x):
+        """Remove every occurrence of x and keep the cursor in place"""
+        if x not in self:
+            return
+        items = list(self)
+        cursor = self.cursor - items[:self.cursor].count(x)
+        self._start = 0
+        self._size = 0
+        for y in items:
+            if y != x:
+                self._buffer[self._size] = y
+                self._size += 1
+        self.cursor = max(0, min(cursor, self._size - 1))
 
 
 class RandomImageList:
+    """
+    Endless random sequence over indices that may grow while in use
+
+    Every element is returned exactly once per cycle. Elements added during
+    a cycle are placed at a random position among the ones not yet returned
+    or peeked at. Elements for which skip(x) is true are passed over but
+    kept.
+    """
+
     cursor = 0
+    # elements after the cursor that peek() already returned
+    _peeked = 0
 
-    def __init__(self, _list):
-        self._list = _list
+    def __init__(self, _list=None, skip=None):
+        self._list = array("L", _list or [])
+        self.skip = skip
+        self._lock = threading.Lock()
         self.shuffle()
 
+    def __len__(self):
+        return len(self._list)
+
+    def add(self, x):
+        with self._lock:
+            self._list.append(x)
+            i = random.randrange(self.cursor + self._peeked, len(self._list))
+            self._list[i], self._list[-1] = self._list[-1], self._list[i]
+
+    def remove(self, x):
+        with self._lock:
+            try:
+                i = self._list.index(x)
+            except ValueError:
+                return
+            del self._list[i]
+            if i < self.cursor:
+                self.cursor -= 1
+            elif i < self.cursor + self._peeked:
+                self._peeked -= 1
+
     def next(self):
-        if self.cursor >= len(self._list):
-            self.shuffle()
-        x = self._list[self.cursor]
-        self.cursor += 1
-        return x
+        with self._lock:
+            if not self._list:
+                raise IndexError("RandomImageList is empty")
+            # the rest of this cycle and a whole new one
+            for _ in range(2 * len(self._list)):
+                if self.cursor >= len(self._list):
+                    self._shuffle()
+                x = self._list[self.cursor]
+                self.cursor += 1
+                self._peeked = max(0, self._peeked - 1)
+                if self.skip is None or not self.skip(x):
+                    return x
+            raise IndexError("RandomImageList has only skipped elements")
+
+    def peek(self, n):
+        """
+        Return up to n elements that next() will return
+
+        Does not look past the end of the current cycle.
+        """
+        with self._lock:
+            if self.cursor >= len(self._list):
+                self._shuffle()
+            result = list()
+            end = self.cursor
+            while end < len(self._list) and len(result) < n:
+                x = self._list[end]
+                end += 1
+                if self.skip is None or not self.skip(x):
+                    result.append(x)
+            self._peeked = max(self._peeked, end - self.cursor)
+            return result
 
     def shuffle(self):
+        with self._lock:
+            self._shuffle()
+
+    def _shuffle(self):
         self.cursor = 0
+        self._peeked = 0
         random.shuffle(self._list)
+
+
+M64 = 0xFFFFFFFFFFFFFFFF
+
+
+def mix(x):
+    """splitmix64 finalizer, a cheap well distributed 64 bit hash"""
+    x = (x + 0x9E3779B97F4A7C15) & M64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & M64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & M64
+    return x ^ (x >> 31)
+
+
+class Permutation:
+    """
+    Seeded bijection over range(n) computed one index at a time
+
+    A small Feistel network permutes the next even power of two, values
+    outside of range(n) are walked until they fall inside. Costs O(1)
+    memory regardless of n.
+    """
+
+    ROUNDS = 4
+
+    def __init__(self, n, seed):
+        self.n = n
+        self.seed = seed
+        bits = max(2, (n - 1).bit_length())
+        bits += bits % 2
+        self._half = bits // 2
+        self._mask = (1 << self._half) - 1
+        self._keys = [mix(seed + r) for r in range(self.ROUNDS)]
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.n:
+            raise IndexError("Permutation index out of range")
+        x = i
+        while True:
+            x = self._encrypt(x)
+            if x < self.n:
+                return x
+
+    def _encrypt(self, x):
+        left, right = x >> self._half, x & self._mask
+        for key in self._keys:
+            left, right = right, left ^ (mix(right ^ key) & self._mask)
+        return (left << self._half) | right
+
+
+class LazyRandomImageList(RandomImageList):
+    """
+    RandomImageList that never shuffles
+
+    Every cycle walks a seeded Permutation of the indices, so starting a
+    new cycle is O(1) and the position within a cycle can be saved as just
+    seed and cursor. Elements added during a cycle sit after the ones the
+    Permutation covers and are drawn at random among the remaining ones,
+    removed elements are skipped. peek() draws ahead into a small buffer
+    that next() consumes first, so both always agree.
+    """
+
+    REMOVED = 0xFFFFFFFF
+
+    def __init__(self, _list=None, seed=None, skip=None):
+        self._list = array("L", _list or [])
+        self.skip = skip
+        self._lock = threading.Lock()
+        # (element, (permutation, position) or None) drawn by peek()
+        self._ahead = deque()
+        self._drawn = 0
+        self._removed = 0
+        self._new_cycle(seed)
+
+    def __len__(self):
+        return len(self._list) - self._removed
+
+    def add(self, x):
+        with self._lock:
+            self._list.append(x)
+
+    def remove(self, x):
+        with self._lock:
+            try:
+                i = self._list.index(x)
+            except ValueError:
+                return
+            self._list[i] = self.REMOVED
+            self._removed += 1
+            if any(y == x for y, _ in self._ahead):
+                self._ahead = deque(e for e in self._ahead if e[0] != x)
+
+    def next(self):
+        with self._lock:
+            skipped = 0
+            while True:
+                if self._ahead:
+                    x, _ = self._ahead.popleft()
+                else:
+                    x, _ = self._draw()
+                if self.skip is None or not self.skip(x):
+                    return x
+                skipped += 1
+                if skipped > 2 * len(self._list):
+                    raise IndexError(
+                        "RandomImageList has only skipped elements")
+
+    def peek(self, n):
+        """Return up to n elements next() will return"""
+        with self._lock:
+            result = [x for x, _ in self._ahead
+                      if self.skip is None or not self.skip(x)][:n]
+            skipped = 0
+            while len(result) < n and skipped <= 2 * len(self._list):
+                try:
+                    entry = self._draw()
+                except IndexError:
+                    break
+                self._ahead.append(entry)
+                if self.skip is None or not self.skip(entry[0]):
+                    result.append(entry[0])
+                else:
+                    skipped += 1
+            return result
+
+    def shuffle(self):
+        with self._lock:
+            self._new_cycle()
+
+    def settle(self):
+        """
+        Turn a cycle that started empty into a regular one
+
+        A list that is filled while in use draws everything from the added
+        elements, which cannot be saved with state(). Once filling is done
+        a new cycle over all elements is started instead.
+        """
+        with self._lock:
+            if len(self._permutation) == 0 and len(self._list):
+                self._new_cycle()
+
+    def state(self):
+        """Return what is needed to continue the current cycle"""
+        with self._lock:
+            permutation, cursor = self._permutation, self.cursor
+            # elements drawn ahead are not shown yet
+            for _, origin in self._ahead:
+                if origin is not None:
+                    permutation, cursor = origin
+                    break
+            return {"seed": permutation.seed, "cursor": cursor,
+                    "n": len(permutation)}
+
+    def restore(self, state):
+        """
+        Continue a cycle saved with state()
+
+        Only possible if the list holds the same elements in the same order
+        as when the state was saved. Returns whether it succeeded.
+        """
+        with self._lock:
+            if self._removed or state["n"] != len(self._list) or \
+                    not 0 <= state["cursor"] <= state["n"]:
+                return False
+            self._permutation = Permutation(state["n"], state["seed"])
+            self.cursor = state["cursor"]
+            self._drawn = 0
+            self._ahead.clear()
+            return True
+
+    def _draw(self):
+        """Return the next element with its origin, the lock is held"""
+        while True:
+            n = len(self._permutation)
+            remaining = n - self.cursor
+            pending = len(self._list) - n - self._drawn
+            if remaining + pending == 0:
+                if len(self._list) == self._removed:
+                    raise IndexError("RandomImageList is empty")
+                self._new_cycle(keep_ahead=True)
+                continue
+
+            if random.randrange(remaining + pending) < pending:
+                # move a random added element to the front of the added ones
+                i = n + self._drawn
+                j = i + random.randrange(pending)
+                self._list[i], self._list[j] = self._list[j], self._list[i]
+                self._drawn += 1
+                x, origin = self._list[i], None
+            else:
+                x = self._list[self._permutation[self.cursor]]
+                origin = (self._permutation, self.cursor)
+                self.cursor += 1
+            if x != self.REMOVED:
+                return x, origin
+
+    def _new_cycle(self, seed=None, keep_ahead=False):
+        if self._removed:
+            self._list = array("L", (x for x in self._list
+                                     if x != self.REMOVED))
+            self._removed = 0
+        if seed is None:
+            seed = random.getrandbits(64)
+        self.cursor = 0
+        self._permutation = Permutation(len(self._list), seed)
+        self._drawn = 0
+        if not keep_ahead:
+            self._ahead.clear()
+
+
+def create_image_list(shuffle="permutation", _list=None, skip=None):
+    """Create a RandomImageList for SlideshowConfig.shuffle"""
+    if shuffle == "permutation":
+        return LazyRandomImageList(_list, skip=skip)
+    return RandomImageList(_list, skip)
+
+
+TABLE_MAGIC = b"BSPT"
+TABLE_HEADER = struct.Struct("<4sIIQQQQ")
+
+
+class PathTable:
+    """
+    Compact table of file paths addressed by integer indices
+
+    Every directory is stored once, file names are kept utf-8 encoded in a
+    single bytearray. A path costs a few bytes plus its name instead of a
+    full string object and a list slot. Removed paths leave a hole, so the
+    indices of all other paths stay valid.
+    """
+
+    REMOVED = 0xFFFFFFFF
+
+    def __init__(self):
+        self._dirs = list()
+        self._dir_ids = dict()
+        self._dir_of = array("L")
+        self._files = dict()
+        self._names = bytearray()
+        self._offsets = array("Q", [0])
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._dir_of)
+
+    def __getitem__(self, i):
+        """Return the path at index i or None if it was removed"""
+        with self._lock:
+            dir_id = self._dir_of[i]
+            if dir_id == self.REMOVED:
+                return None
+            d = self._dirs[dir_id]
+            name = self._name(i)
+        return os.path.join(d, name.decode("utf-8", "surrogateescape"))
+
+    def _name(self, i):
+        return self._names[self._offsets[i]:self._offsets[i + 1]]
+
+    def add(self, path):
+        """Add path and return its index"""
+        d, name = os.path.split(path)
+        name = name.encode("utf-8", "surrogateescape")
+        with self._lock:
+            return self._add(d, name)
+
+    def add_new(self, path):
+        """Add path unless it is already known, return its index or None"""
+        d, name = os.path.split(path)
+        name = name.encode("utf-8", "surrogateescape")
+        with self._lock:
+            if self._find(d, name) is not None:
+                return None
+            return self._add(d, name)
+
+    def find(self, path):
+        """Return the index of path or None"""
+        d, name = os.path.split(path)
+        with self._lock:
+            return self._find(d, name.encode("utf-8", "surrogateescape"))
+
+    def remove(self, path):
+        """
+        Remove path and return the removed indices
+
+        If path is a directory all paths below it are removed.
+        """
+        d, name = os.path.split(path)
+        prefix = os.path.join(path, "")
+        removed = list()
+        with self._lock:
+            i = self._find(d, name.encode("utf-8", "surrogateescape"))
+            if i is not None:
+                self._files[self._dir_of[i]].remove(i)
+                self._dir_of[i] = self.REMOVED
+                removed.append(i)
+
+            for dir_id, d in enumerate(self._dirs):
+                if (d == path or d.startswith(prefix)) and \
+                        dir_id in self._files:
+                    for i in self._files.pop(dir_id):
+                        self._dir_of[i] = self.REMOVED
+                        removed.append(i)
+        return removed
+
+    def indices(self):
+        """Return the indices of all paths that were not removed"""
+        with self._lock:
+            return array("L", (i for i, d in enumerate(self._dir_of)
+                               if d != self.REMOVED))
+
+    def dirs(self):
+        """Return all directories that still contain paths"""
+        with self._lock:
+            return [self._dirs[d] for d, files in self._files.items()
+                    if files]
+
+    def names(self, d):
+        """Return {name: index} of all paths in directory d"""
+        with self._lock:
+            return {self._name(i).decode("utf-8", "surrogateescape"): i
+                    for i in self._files.get(self._dir_ids.get(d), ())}
+
+    def dump(self, filename):
+        """Write the table to filename, replacing it atomically"""
+        with self._lock:
+            dirs = "\0".join(self._dirs).encode("utf-8", "surrogateescape")
+            parts = [dirs, self._dir_of.tobytes(), self._offsets.tobytes(),
+                     bytes(self._names)]
+        header = TABLE_HEADER.pack(TABLE_MAGIC, self._dir_of.itemsize,
+                                   len(self._dirs), *map(len, parts))
+        tmp = filename + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(header)
+            for part in parts:
+                f.write(part)
+        os.replace(tmp, filename)
+
+    def load(self, filename):
+        """Replace the table with one written by dump, returns success"""
+        try:
+            with open(filename, "rb") as f:
+                data = f.read()
+            magic, itemsize, ndirs, *sizes = TABLE_HEADER.unpack_from(data)
+        except (OSError, struct.error):
+            return False
+        if magic != TABLE_MAGIC or itemsize != self._dir_of.itemsize or \
+                len(data) != TABLE_HEADER.size + sum(sizes):
+            return False
+
+        view = memoryview(data)[TABLE_HEADER.size:]
+        parts = list()
+        for size in sizes:
+            parts.append(view[:size])
+            view = view[size:]
+
+        dirs = bytes(parts[0]).decode("utf-8", "surrogateescape")
+        dir_of = array("L")
+        dir_of.frombytes(parts[1])
+        offsets = array("Q")
+        offsets.frombytes(parts[2])
+
+        with self._lock:
+            self._dirs = dirs.split("\0") if ndirs else list()
+            self._dir_ids = {d: i for i, d in enumerate(self._dirs)}
+            self._dir_of = dir_of
+            self._offsets = offsets
+            self._names = bytearray(parts[3])
+            self._files = dict()
+            for i, d in enumerate(dir_of):
+                if d != self.REMOVED:
+                    self._files.setdefault(d, array("L")).append(i)
+        return True
+
+    def _add(self, d, name):
+        dir_id = self._dir_ids.get(d)
+        if dir_id is None:
+            dir_id = len(self._dirs)
+            self._dirs.append(d)
+            self._dir_ids[d] = dir_id
+        i = len(self._dir_of)
+        self._dir_of.append(dir_id)
+        self._files.setdefault(dir_id, array("L")).append(i)
+        self._names += name
+        self._offsets.append(len(self._names))
+        return i
+
+    def _find(self, d, name):
+        dir_id = self._dir_ids.get(d)
+        for i in self._files.get(dir_id, ()):
+            if self._name(i) == name:
+                return i
+        return None
+
+
+class LRUCache:
+    """
+    Least recently used cache bounded by the total size of its values
+
+    sizeof(value) has to return the size of a value in bytes.
+    """
+
+    def __init__(self, max_bytes, sizeof):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.bytes = 0
+        self._entries = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        if key not in self._entries:
+            return None
+        self._entries.move_to_end(key)
+        return self._entries[key][0]
+
+    def put(self, key, value):
+        self.pop(key)
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (value, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, (_, size) = self._entries.popitem(last=False)
+            self.bytes -= size
+
+    def pop(self, key):
+        if key in self._entries:
+            value, size = self._entries.pop(key)
+            self.bytes -= size
+            return value
+
+    def retain(self, keys):
+        """Drop all entries whose key is not in keys"""
+        for key in [k for k in self._entries if k not in keys]:
+            self.pop(key)
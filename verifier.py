@@ -0,0 +1,272 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from loader import ImageTooLarge, verify_image
+from logger import create_logger
+from stats import stats
+logger = create_logger(__name__)
+
+
+class Quarantine:
+    """
+    Images that failed to load, kept across restarts
+
+    Entries are stored by path with the number of failures, the time of
+    the next retry and the last error. The backoff doubles with every
+    failure. An image is only a member until its backoff expired, so the
+    slideshow tries it again even without a Verifier, and releases it or
+    adds it again. Membership is tested by index against plain dicts
+    without taking the lock, so the GUI thread can ask at any time.
+    Changes are written SAVE_DELAY seconds later on a timer thread, never
+    by the thread that made them.
+    """
+
+    # first retry after a failure, in seconds
+    BACKOFF = 15 * 60
+    MAX_BACKOFF = 7 * 24 * 60 * 60
+    # seconds changes are collected before they are written
+    SAVE_DELAY = 5
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self._entries = dict()
+        self._indices = dict()
+        self._dirty = False
+        self._timer = None
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+
+    def __contains__(self, image):
+        path = self._indices.get(image)
+        if path is None:
+            return False
+        entry = self._entries.get(path)
+        return entry is not None and entry[1] > time.time()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def load(self, paths):
+        """Read the saved entries and find their indices in paths"""
+        if not self.filename:
+            return
+        try:
+            with open(self.filename) as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning("Cannot load Quarantine: {}".format(e))
+            return
+
+        with self._lock:
+            self._entries = {path: list(entry)
+                             for path, entry in entries.items()}
+            for path in self._entries:
+                image = paths.find(path)
+                if image is not None:
+                    self._indices[image] = path
+        logger.info("{} Images in Quarantine".format(len(self._entries)))
+
+    def save(self):
+        """Write the entries now if they changed"""
+        if not self.filename:
+            return
+        with self._save_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self._dirty:
+                    return
+                self._dirty = False
+                data = json.dumps(self._entries)
+            tmp = self.filename + ".tmp"
+            try:
+                with open(tmp, "w") as f:
+                    f.write(data)
+                os.replace(tmp, self.filename)
+            except OSError as e:
+                logger.warning("Cannot save Quarantine: {}".format(e))
+
+    def added(self, image, path):
+        """Map a path the Library added to its index"""
+        if path in self._entries:
+            with self._lock:
+                self._indices[image] = path
+
+    def add(self, image, path, error):
+        """Quarantine image until its backoff expired"""
+        with self._lock:
+            failures = self._entries.get(path, [0])[0] + 1
+            backoff = min(self.MAX_BACKOFF,
+                          self.BACKOFF * 2 ** (failures - 1))
+            self._entries[path] = [failures, time.time() + backoff,
+                                   str(error)]
+            self._indices[image] = path
+            self._changed()
+        stats.count("images_quarantined")
+        logger.warning("Quarantined {} for {} s: {}".format(path, backoff,
+                                                            error))
+
+    def release(self, image):
+        """Take an image that loads again out of quarantine"""
+        path = self.discard(image)
+        if path is not None:
+            logger.info("Released {} from Quarantine".format(path))
+
+    def discard(self, image):
+        """Forget image, e.g. because it was removed, returns its path"""
+        if image not in self._indices:
+            return None
+        with self._lock:
+            path = self._indices.pop(image, None)
+            if path is None:
+                return None
+            self._entries.pop(path, None)
+            self._changed()
+        return path
+
+    def retry(self, image):
+        """Let the backoff of image expire, e.g. because it was rewritten"""
+        with self._lock:
+            path = self._indices.get(image)
+            if path is not None:
+                self._entries[path][1] = 0
+                self._changed()
+
+    def due(self):
+        """Return the quarantined images whose backoff expired"""
+        now = time.time()
+        with self._lock:
+            return [image for image, path in self._indices.items()
+                    if self._entries[path][1] <= now]
+
+    def _changed(self):
+        """Save a little later, the lock is held"""
+        self._dirty = True
+        if self.filename and self._timer is None:
+            self._timer = threading.Timer(self.SAVE_DELAY, self.save)
+            self._timer.daemon = True
+            self._timer.start()
+
+
+class Verifier(threading.Thread):
+    """
+    Check the images of a Library before they are shown
+
+    Every image is opened and decoded as cheaply as loader.verify_image
+    allows, images passed to ahead() first, then the whole library in
+    index order and the quarantined ones once their backoff expired.
+    Remote sources are not swept, as that would download the whole
+    library and push the upcoming images out of the ByteCache. Images that
+    fail go to the Quarantine, unless the Library cannot reach their
+    directory at all. Verified images are kept in a bitmap until
+    invalidate() is called for them. The thread runs at the lowest
+    scheduling priority and pauses delay seconds after every image, so a
+    slow or hanging file only ever stalls the verifier.
+    """
+
+    # images the slideshow asks to verify ahead of display
+    AHEAD = 16
+    # seconds to sleep once everything is verified
+    IDLE = 60
+
+    def __init__(self, library, quarantine, delay=1.0, max_pixels=None,
+                 max_bytes=None):
+        super().__init__(name=type(self).__name__, daemon=True)
+        self.library = library
+        self.quarantine = quarantine
+        self.delay = delay
+        self.max_pixels = max_pixels
+        self.max_bytes = max_bytes
+        self.sweep = not library.source.remote
+        self._verified = bytearray()
+        self._ahead = deque(maxlen=self.AHEAD)
+        self._cursor = 0
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+
+    def ahead(self, images):
+        """Verify images next, never blocks"""
+        self._ahead.extend(x for x in images if not self.verified(x))
+        if self._ahead:
+            self._wake.set()
+
+    def verified(self, image):
+        """Return whether image loaded since it was last invalidated"""
+        i, bit = divmod(image, 8)
+        return i < len(self._verified) and bool(self._verified[i] >> bit & 1)
+
+    def invalidate(self, image):
+        """Verify image again, e.g. because its file was rewritten"""
+        i, bit = divmod(image, 8)
+        with self._lock:
+            if not self.verified(image):
+                return
+            self._verified[i] &= ~(1 << bit) & 0xFF
+            self._cursor = min(self._cursor, image)
+        self._wake.set()
+
+    def run(self):
+        try:
+            # only threads on Linux have their own nice value
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except (AttributeError, OSError) as e:
+            logger.debug("Cannot lower Verifier priority: %s", e)
+
+        while True:
+            image = self.next()
+            if image is None:
+                self._wake.wait(self.IDLE)
+                self._wake.clear()
+                continue
+            path = self.library.paths[image]
+            if path is not None:
+                self.verify(image, path)
+                self._wake.wait(self.delay)
+                self._wake.clear()
+
+    def next(self):
+        """Return the next image to verify or None"""
+        while self._ahead:
+            image = self._ahead.popleft()
+            if not self.verified(image) and image not in self.quarantine:
+                return image
+
+        with self._lock:
+            while self.sweep and self._cursor < len(self.library.paths):
+                image = self._cursor
+                self._cursor += 1
+                if not self.verified(image) and image not in self.quarantine:
+                    return image
+
+        due = self.quarantine.due()
+        if due:
+            return due[0]
+        return None
+
+    def verify(self, image, path):
+        try:
+            with stats.span("verify"):
+                verify_image(path, self.max_pixels, self.max_bytes,
+                             self.library.source)
+        except ImageTooLarge:
+            # not broken, the slideshow skips it on its own
+            pass
+        except Exception as e:
+            if self.library.reachable(path):
+                self.quarantine.add(image, path, e)
+            else:
+                logger.warning("Cannot verify %s: %s", path, e)
+            return
+        i, bit = divmod(image, 8)
+        with self._lock:
+            if i >= len(self._verified):
+                self._verified.extend(bytes(i + 1 - len(self._verified)))
+            self._verified[i] |= 1 << bit
+        stats.count("images_verified")
+        self.quarantine.release(image)
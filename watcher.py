@@ -0,0 +1,253 @@
+import ctypes
+import ctypes.util
+import os
+import os.path
+import sqlite3
+import struct
+import sys
+import threading
+import time
+from abc import ABCMeta, abstractmethod
+
+from logger import create_logger
+from util import ScanError, iter_files, list_dir, walk
+logger = create_logger(__name__)
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+EVENT = struct.Struct("iIII")
+
+
+class Watcher(threading.Thread, metaclass=ABCMeta):
+    """
+    Report files that are added to or removed from the image path
+
+    added(path) is called for every new file with one of the extensions,
+    removed(path) for every removed file or directory. Renames are
+    reported as a removal followed by an addition. lost() is called when
+    changes may have been missed and the image path has to be rescanned.
+    If index_path is set the file index is kept up to date as well.
+
+    The Watcher does not walk the image path itself. The Scanner reports
+    every directory it walks to visited(d) and every path it knows to
+    scanned(paths) once it is done.
+    """
+
+    def __init__(self, path, extensions, added, removed, index_path=None,
+                 lost=None):
+        super().__init__(name=type(self).__name__, daemon=True)
+        self.path = os.path.normpath(path)
+        self.extensions = extensions
+        self.added = added
+        self.removed = removed
+        self.lost = lost
+        self.index_path = index_path
+        self.index = None
+
+    def run(self):
+        if self.index_path:
+            from index import FileIndex
+            self.index = FileIndex(self.index_path)
+        try:
+            self.watch()
+        except Exception as e:
+            logger.exception(e)
+        finally:
+            if self.index is not None:
+                self.index.close()
+
+    @abstractmethod
+    def watch(self):
+        """Report changes until the process ends"""
+
+    def visited(self, d):
+        """The Scanner walked directory d"""
+
+    def scanned(self, paths):
+        """The Scanner is done, paths are all known files"""
+
+    def matches(self, path):
+        name = os.path.basename(path)
+        _, ext = os.path.splitext(name)
+        return not name.startswith(".") and ext.lower() in self.extensions
+
+    def on_added(self, path):
+        logger.info("Image added: " + path)
+        if self.index is not None:
+            self.write_index(self.index.add_file, path)
+        self.added(path)
+
+    def on_removed(self, path):
+        logger.info("Image removed: " + path)
+        if self.index is not None:
+            self.write_index(self.index.remove_path, path)
+        self.removed(path)
+
+    def write_index(self, write, path):
+        """Update the file index, a rescan repairs it if it is locked"""
+        try:
+            write(path)
+        except sqlite3.OperationalError as e:
+            logger.warning("Cannot update File Index for {}: {}".format(
+                path, e))
+            if self.lost is not None:
+                self.lost()
+
+
+class InotifyWatcher(Watcher):
+    """Watcher based on Linux inotify, every directory gets a watch"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"),
+                                use_errno=True)
+        self.fd = self.libc.inotify_init1(0)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = dict()
+
+    def add_watch(self, d):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(d), WATCH_MASK)
+        if wd < 0:
+            logger.warning("Cannot watch {}: {}".format(
+                d, os.strerror(ctypes.get_errno())))
+            return
+        self.watches[wd] = d
+
+    # the directories arrive from the walk of the Scanner
+    visited = add_watch
+
+    def add_watches(self, path):
+        """Watch path and every directory below it"""
+        for d, _ in walk(path, lambda d: (None, list_dir(d)[1])):
+            self.add_watch(d)
+
+    def watch(self):
+        logger.info("Watching {} with inotify".format(self.path))
+        while True:
+            data = os.read(self.fd, 64 * 1024)
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT.unpack_from(data, offset)
+                offset += EVENT.size
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+                self.handle(wd, mask, os.fsdecode(name))
+
+    def handle(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            logger.warning("inotify queue overflowed, rescanning")
+            if self.lost is not None:
+                self.lost()
+            return
+        if mask & IN_IGNORED:
+            self.watches.pop(wd, None)
+            return
+
+        d = self.watches.get(wd)
+        if d is None or not name or name.startswith("."):
+            return
+        path = os.path.join(d, name)
+
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                self.add_watches(path)
+                try:
+                    for filename in iter_files(path, self.extensions):
+                        self.on_added(filename)
+                except ScanError as e:
+                    logger.warning(e)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self.remove_watches(path)
+                self.on_removed(path)
+        elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+            if self.matches(path):
+                self.on_added(path)
+        elif mask & (IN_DELETE | IN_MOVED_FROM):
+            if self.matches(path):
+                self.on_removed(path)
+
+    def remove_watches(self, path):
+        prefix = os.path.join(path, "")
+        for wd, d in list(self.watches.items()):
+            if d == path or d.startswith(prefix):
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.watches[wd]
+
+
+class PollingWatcher(Watcher):
+    """
+    Watcher that rescans the image path every interval seconds
+
+    The first rescan is compared with the paths the Scanner found. A
+    rescan that cannot read the image path or a directory with known
+    images is ignored.
+    """
+
+    def __init__(self, *args, interval=300, source=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.interval = interval
+        self.source = source
+        self._known = None
+        self._seeded = threading.Event()
+
+    def scanned(self, paths):
+        self._known = set(paths)
+        self._seeded.set()
+
+    def files(self, known):
+        dirs = {os.path.dirname(path) for path in known}
+        if self.source is not None and self.source.remote:
+            return set(self.source.iter_files(self.extensions, known=dirs))
+        if self.index is not None:
+            return set(self.index.iter_files(self.path, self.extensions,
+                                             known=dirs))
+        return set(iter_files(self.path, self.extensions, known=dirs))
+
+    def watch(self):
+        logger.info("Polling {} every {} s".format(self.path, self.interval))
+        self._seeded.wait()
+        known = self._known
+        self._known = None
+        while True:
+            time.sleep(self.interval)
+            try:
+                files = self.files(known)
+            except (ScanError, sqlite3.OperationalError) as e:
+                logger.warning("Skipping poll: {}".format(e))
+                continue
+            for path in known - files:
+                # the index already forgot it during the rescan
+                logger.info("Image removed: " + path)
+                self.removed(path)
+            for path in files - known:
+                logger.info("Image added: " + path)
+                self.added(path)
+            known = files
+
+
+def create_watcher(path, extensions, added, removed, index_path=None,
+                   interval=300, source=None, lost=None):
+    """Create an InotifyWatcher if possible, a PollingWatcher otherwise"""
+    if sys.platform.startswith("linux") and \
+            not (source is not None and source.remote):
+        try:
+            return InotifyWatcher(path, extensions, added, removed,
+                                  index_path, lost)
+        except (OSError, AttributeError) as e:
+            logger.warning("inotify not available: {}".format(e))
+    return PollingWatcher(path, extensions, added, removed, index_path, lost,
+                          interval=interval, source=source)